@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from .models import ShipStore, Level, ShipUpgrade, Item, Island, Slot, Version, Ship, Port, Dock, DockChart, FineLog, \
-    RevenueLog, PortType
+    RevenueLog, PortType, ArchivedDockChart, ArchivedFineLog, ArchivedRevenueLog, PlayerDailyStats, PortDailyStats, \
+    IslandDailyStats
 
 
 class ShipStoreModelAdmin(admin.ModelAdmin):
@@ -29,6 +30,33 @@ class DockChartModelAdmin(admin.ModelAdmin):
     list_display = ('ship', 'port', 'start_time', 'end_time', 'is_success')
 
 
+class ArchivedDockChartModelAdmin(admin.ModelAdmin):
+    list_display = ('id', 'ship', 'port', 'start_time', 'end_time', 'is_success')
+    raw_id_fields = ('ship', 'port')
+
+
+class PlayerDailyStatsModelAdmin(admin.ModelAdmin):
+    list_display = ('day', 'user', 'item', 'earned', 'undockings')
+    list_filter = ('item',)
+    date_hierarchy = 'day'
+    list_select_related = ('user', 'item')
+    raw_id_fields = ('user',)
+
+
+class PortDailyStatsModelAdmin(admin.ModelAdmin):
+    list_display = ('day', 'port', 'dockings', 'fines', 'fine_amount')
+    date_hierarchy = 'day'
+    list_select_related = ('port__user', 'port__type')
+    raw_id_fields = ('port',)
+
+
+class IslandDailyStatsModelAdmin(admin.ModelAdmin):
+    list_display = ('day', 'island', 'dockings', 'undockings', 'fines')
+    list_filter = ('island',)
+    date_hierarchy = 'day'
+    list_select_related = ('island',)
+
+
 class PortModelAdmin(admin.ModelAdmin):
     list_display = ('user', 'type', 'log')
 
@@ -48,3 +76,9 @@ admin.site.register(Dock)
 admin.site.register(DockChart, DockChartModelAdmin)
 admin.site.register(FineLog)
 admin.site.register(RevenueLog)
+admin.site.register(ArchivedDockChart, ArchivedDockChartModelAdmin)
+admin.site.register(ArchivedFineLog)
+admin.site.register(ArchivedRevenueLog)
+admin.site.register(PlayerDailyStats, PlayerDailyStatsModelAdmin)
+admin.site.register(PortDailyStats, PortDailyStatsModelAdmin)
+admin.site.register(IslandDailyStats, IslandDailyStatsModelAdmin)
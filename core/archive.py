@@ -0,0 +1,68 @@
+"""
+Moves closed dock charts, with their fines and revenues, from the hot tables into the archive tables
+
+Every chunk is moved in its own transaction, so an interrupted run loses nothing and the next run picks up
+where it stopped. Charts being archived by another run are skipped rather than waited for.
+"""
+from django.db import connection, transaction
+
+CHART_COLUMNS = 'id, start_time, end_time, expires_at, is_success, ship_id, port_id'
+FINE_COLUMNS = 'id, amount, dock_chart_id'
+REVENUE_COLUMNS = 'id, item_collected, item_id, dock_chart_id'
+
+
+def archive_chunk(before, chunk_size):
+    """
+    Archives up to `chunk_size` charts closed before `before`, returns the number of charts moved
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id FROM core_dockchart WHERE end_time IS NOT NULL AND end_time < %s "
+            "ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+            [before, chunk_size]
+        )
+        chart_ids = [row[0] for row in cursor.fetchall()]
+        if not chart_ids:
+            return 0
+
+        cursor.execute(
+            "INSERT INTO core_archiveddockchart (" + CHART_COLUMNS + ") "
+            "SELECT " + CHART_COLUMNS + " FROM core_dockchart WHERE id = ANY(%s) "
+            "ON CONFLICT (id) DO NOTHING",
+            [chart_ids]
+        )
+        cursor.execute(
+            "WITH moved AS (DELETE FROM core_finelog WHERE dock_chart_id = ANY(%s) RETURNING " + FINE_COLUMNS + ") "
+            "INSERT INTO core_archivedfinelog (" + FINE_COLUMNS + ") SELECT " + FINE_COLUMNS + " FROM moved "
+            "ON CONFLICT (id) DO NOTHING",
+            [chart_ids]
+        )
+        cursor.execute(
+            "WITH moved AS (DELETE FROM core_revenuelog WHERE dock_chart_id = ANY(%s) "
+            "RETURNING " + REVENUE_COLUMNS + ") "
+            "INSERT INTO core_archivedrevenuelog (" + REVENUE_COLUMNS + ") SELECT " + REVENUE_COLUMNS + " FROM moved "
+            "ON CONFLICT (id) DO NOTHING",
+            [chart_ids]
+        )
+        cursor.execute("DELETE FROM core_dockchart WHERE id = ANY(%s)", [chart_ids])
+        return len(chart_ids)
+
+
+def purge_chunk(before, chunk_size):
+    """
+    Deletes up to `chunk_size` archived charts closed before `before` along with their logs,
+    returns the number of charts deleted
+    """
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT id FROM core_archiveddockchart WHERE end_time < %s ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED",
+            [before, chunk_size]
+        )
+        chart_ids = [row[0] for row in cursor.fetchall()]
+        if not chart_ids:
+            return 0
+
+        cursor.execute("DELETE FROM core_archivedfinelog WHERE dock_chart_id = ANY(%s)", [chart_ids])
+        cursor.execute("DELETE FROM core_archivedrevenuelog WHERE dock_chart_id = ANY(%s)", [chart_ids])
+        cursor.execute("DELETE FROM core_archiveddockchart WHERE id = ANY(%s)", [chart_ids])
+        return len(chart_ids)
@@ -0,0 +1,116 @@
+"""
+HTTP caching of the responses built from the catalog
+
+Catalog responses carry a strong ETag made from the catalog version stamp kept in the database, which
+every worker checks at most every CHECK_INTERVAL seconds. Clients revalidate them with If-None-Match and
+get a 304 before the view touches the database or a serializer. The rendered JSON, gzipped when the client
+accepts it, is kept per worker and served as is until the version changes.
+"""
+import gzip
+from functools import wraps
+from threading import Lock
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+
+from core.catalog import get_catalog
+
+# Rendered responses kept per worker, the cache is emptied when it grows past this
+MAX_ENTRIES = 256
+
+_rendered = {}
+_rendered_version = None
+_lock = Lock()
+
+
+def catalog_etag(version, gzipped=False):
+    if gzipped:
+        return '"catalog-{}-json-gzip"'.format(version)
+    return '"catalog-{}-json"'.format(version)
+
+
+def _matches(etag, if_none_match):
+    """
+    Whether an If-None-Match header matches the strong `etag`
+    """
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or etag in tags
+
+
+def _accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def _render(view, method, request, args, kwargs, gzipped):
+    """
+    Runs the view and returns (content, content type) of its response, None if it can't be shared
+    """
+    response = method(view, request, *args, **kwargs)
+    response = view.finalize_response(request, response, *args, **kwargs)
+    response.render()
+    if response.status_code != 200:
+        return response, None
+
+    content = response.content
+    if gzipped:
+        content = gzip.compress(content)
+    return response, (content, response['Content-Type'])
+
+
+def _store(version, key, entry):
+    global _rendered_version
+    with _lock:
+        if version != _rendered_version or len(_rendered) >= MAX_ENTRIES:
+            _rendered.clear()
+            _rendered_version = version
+        _rendered[key] = entry
+
+
+def clear():
+    with _lock:
+        _rendered.clear()
+
+
+def catalog_cached(method):
+    """
+    Decorates the get method of a catalog view to answer If-None-Match with a 304
+    and to serve the rendered bytes of earlier responses
+    """
+
+    @wraps(method)
+    def wrapper(view, request, *args, **kwargs):
+        # The renderer was picked from Accept and ?format= before the handler ran.
+        # The browsable API renders the user into the page, so only JSON is shared.
+        if request.accepted_renderer.format != 'json':
+            return method(view, request, *args, **kwargs)
+
+        # Shared by the workers, so they all hand out the same ETag for the same catalog
+        version = get_catalog().version
+        gzipped = _accepts_gzip(request)
+        etag = catalog_etag(version, gzipped)
+
+        if _matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            query = tuple((name, tuple(values)) for name, values in sorted(request.query_params.lists()))
+            key = (type(view).__name__, args, tuple(sorted(kwargs.items())), query, version,
+                   request.accepted_media_type, gzipped)
+            entry = _rendered.get(key)
+            if entry is None:
+                response, entry = _render(view, method, request, args, kwargs, gzipped)
+                if entry is None:
+                    return response
+                _store(version, key, entry)
+
+            content, content_type = entry
+            response = HttpResponse(content, content_type=content_type)
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+        # Clients may keep the response but have to revalidate it, which is cheap
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return wrapper
@@ -0,0 +1,223 @@
+"""
+Per worker cache of the static game data (items, islands, levels, slots, port types and the ship store)
+
+The catalog is loaded once per worker into immutable structures. Saving or deleting any catalog model
+drops the local copy and bumps the version stamp kept in the database, which other workers check at most
+every CHECK_INTERVAL seconds.
+"""
+import time
+from collections import namedtuple
+from threading import Lock
+from types import MappingProxyType
+
+from django.db import connection
+# Seconds a worker trusts its catalog before checking the shared version stamp again
+CHECK_INTERVAL = 5
+
+ItemEntry = namedtuple('ItemEntry', ('id', 'name'))
+IslandEntry = namedtuple('IslandEntry', ('id', 'name', 'item_id', 'habitable'))
+LevelEntry = namedtuple('LevelEntry', ('id', 'level_number', 'experience_required'))
+SlotEntry = namedtuple('SlotEntry', ('id', 'unlock_level_id', 'gold'))
+PortTypeEntry = namedtuple('PortTypeEntry', ('id', 'name', 'penalizable', 'ownable'))
+ShipStoreEntry = namedtuple('ShipStoreEntry', ('id', 'name', 'cost_multiplier', 'experience_gain', 'image', 'buy_cost',
+                                               'ship_lvl'))
+ShipUpgradeEntry = namedtuple('ShipUpgradeEntry', ('id', 'ship_store_id', 'count', 'item_id'))
+# Gold and items (by name) required to reach a ship level, summed over all levels up to it.
+# An item which is not required up to that level has no entry, as its sum would be NULL.
+CumulativeCost = namedtuple('CumulativeCost', ('gold', 'items'))
+
+
+class Table(object):
+    """
+    Rows of one model ordered by id, indexed by id and, if the rows have one, by name
+    """
+    __slots__ = ('rows', 'by_id', 'by_name')
+
+    def __init__(self, rows):
+        rows = tuple(rows)
+        object.__setattr__(self, 'rows', rows)
+        object.__setattr__(self, 'by_id', MappingProxyType({row.id: row for row in rows}))
+        by_name = {}
+        if 'name' in getattr(rows[0] if rows else None, '_fields', ()):
+            by_name = {row.name: row for row in rows}
+        object.__setattr__(self, 'by_name', MappingProxyType(by_name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Catalog tables are read only')
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class Catalog(object):
+    __slots__ = ('version', 'items', 'islands', 'levels', 'slots', 'port_types', 'ship_stores', 'ship_upgrades',
+                 'ship_stores_by_cost', '_upgrades_by_ship_store', '_cumulative_costs')
+
+    def __init__(self, version, items, islands, levels, slots, port_types, ship_stores, ship_upgrades):
+        values = {
+            'version': version,
+            'items': Table(ItemEntry(*row) for row in items),
+            'islands': Table(IslandEntry(*row) for row in islands),
+            'levels': Table(LevelEntry(*row) for row in levels),
+            'slots': Table(SlotEntry(*row) for row in slots),
+            'port_types': Table(PortTypeEntry(*row) for row in port_types),
+            'ship_stores': Table(ShipStoreEntry(*row) for row in ship_stores),
+            'ship_upgrades': Table(ShipUpgradeEntry(*row) for row in ship_upgrades),
+        }
+        values['ship_stores_by_cost'] = tuple(
+            sorted(values['ship_stores'], key=lambda ship_store: (ship_store.buy_cost, ship_store.id))
+        )
+        upgrades = {}
+        for upgrade in values['ship_upgrades']:
+            upgrades.setdefault(upgrade.ship_store_id, []).append(upgrade)
+        values['_upgrades_by_ship_store'] = MappingProxyType(
+            {ship_store_id: tuple(rows) for ship_store_id, rows in upgrades.items()}
+        )
+        values['_cumulative_costs'] = self._prefix_sums(values['ship_stores'], upgrades, values['items'])
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('The catalog is read only')
+
+    @staticmethod
+    def _prefix_sums(ship_stores, upgrades, items):
+        """
+        Running totals of the gold and items required by the ship stores, in ship level order
+        """
+        costs = {}
+        gold = 0
+        required = {}
+        for ship_store in sorted((row for row in ship_stores if row.ship_lvl is not None),
+                                 key=lambda row: row.ship_lvl):
+            gold += ship_store.buy_cost
+            for upgrade in upgrades.get(ship_store.id, ()):
+                name = items.by_id[upgrade.item_id].name
+                required[name] = required.get(name, 0) + upgrade.count
+            costs[ship_store.ship_lvl] = CumulativeCost(gold, MappingProxyType(dict(required)))
+        return MappingProxyType(costs)
+
+    @classmethod
+    def load(cls, version):
+        from core.models import Island, Item, Level, PortType, ShipStore, ShipUpgrade, Slot
+        return cls(
+            version,
+            items=Item.objects.order_by('id').values_list('id', 'name'),
+            islands=Island.objects.order_by('id').values_list('id', 'name', 'item_id', 'habitable'),
+            levels=Level.objects.order_by('id').values_list('id', 'level_number', 'experience_required'),
+            slots=Slot.objects.order_by('id').values_list('id', 'unlock_level_id', 'gold'),
+            port_types=PortType.objects.order_by('id').values_list('id', 'name', 'penalizable', 'ownable'),
+            ship_stores=ShipStore.objects.order_by('id').values_list('id', 'name', 'cost_multiplier',
+                                                                     'experience_gain', 'image', 'buy_cost',
+                                                                     'ship_lvl'),
+            ship_upgrades=ShipUpgrade.objects.order_by('id').values_list('id', 'ship_store_id', 'count', 'item_id'),
+        )
+
+    def item(self, name):
+        return self.items.by_name[name]
+
+    @property
+    def habitable_islands(self):
+        return tuple(island for island in self.islands if island.habitable)
+
+    @property
+    def parking_port_type(self):
+        return self._port_type(penalizable=False, ownable=True)
+
+    @property
+    def non_parking_port_type(self):
+        return self._port_type(penalizable=True, ownable=True)
+
+    def _port_type(self, penalizable, ownable):
+        for port_type in self.port_types:
+            if port_type.penalizable == penalizable and port_type.ownable == ownable:
+                return port_type
+        raise KeyError('No port type with penalizable={} and ownable={}'.format(penalizable, ownable))
+
+    def unlock_experience(self, slot_id):
+        """
+        Experience required to unlock a slot
+        """
+        return self.levels.by_id[self.slots.by_id[slot_id].unlock_level_id].experience_required
+
+    @property
+    def raft(self):
+        """
+        Cheapest ship in the store
+        """
+        return self.ship_stores_by_cost[0]
+
+    def is_last_ship_store(self, ship_store_id):
+        return self.ship_stores_by_cost[-1].id == ship_store_id
+
+    def next_ship_store(self, ship_store_id):
+        """
+        Ship store a ship can be upgraded to, None for the most expensive one
+        """
+        buy_cost = self.ship_stores.by_id[ship_store_id].buy_cost
+        for ship_store in self.ship_stores_by_cost:
+            if ship_store.buy_cost > buy_cost:
+                return ship_store
+        return None
+
+    def cumulative_cost(self, ship_lvl):
+        """
+        Gold and items required to get the ship store of `ship_lvl`, including all the ships below it
+        """
+        return self._cumulative_costs.get(ship_lvl, CumulativeCost(None, MappingProxyType({})))
+
+    def upgrades_for(self, ship_store_id):
+        """
+        Items required to get a ship store
+        """
+        return self._upgrades_by_ship_store.get(ship_store_id, ())
+
+
+_catalog = None
+_checked_at = 0
+_lock = Lock()
+
+
+def current_version():
+    """
+    Version stamp shared by the workers, kept in the single row of CatalogVersion
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT version FROM core_catalogversion WHERE id = 1")
+        row = cursor.fetchone()
+    return row[0] if row is not None else 0
+
+
+def get_catalog():
+    """
+    Returns the catalog of this worker, reloading it when another worker has invalidated it
+    """
+    global _catalog, _checked_at
+    catalog = _catalog
+    if catalog is not None and time.time() - _checked_at < CHECK_INTERVAL:
+        return catalog
+
+    with _lock:
+        version = current_version()
+        if _catalog is None or _catalog.version != version:
+            _catalog = Catalog.load(version)
+        _checked_at = time.time()
+        return _catalog
+
+
+def _bump_version():
+    with connection.cursor() as cursor:
+        cursor.execute("UPDATE core_catalogversion SET version = version + 1 WHERE id = 1")
+
+
+def invalidate():
+    """
+    Drops the catalog of this worker and bumps the version stamp, which the other workers
+    see once the current transaction commits
+    """
+    global _catalog
+    _catalog = None
+    _bump_version()
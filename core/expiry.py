@@ -0,0 +1,50 @@
+import heapq
+
+from core.models import DockChart
+
+
+class ExpiryQueue(object):
+    """
+    Min-heap of open dock charts ordered by the time their docking runs out
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._queued = set()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, chart_id, expires_at):
+        if chart_id in self._queued:
+            return False
+        self._queued.add(chart_id)
+        heapq.heappush(self._heap, (expires_at, chart_id))
+        return True
+
+    def next_due(self):
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def pop_due(self, now, limit):
+        """
+        Removes and returns up to `limit` chart ids which are due at `now`
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < limit:
+            _, chart_id = heapq.heappop(self._heap)
+            self._queued.discard(chart_id)
+            due.append(chart_id)
+        return due
+
+    def refill(self, horizon, limit):
+        """
+        Queues open charts running out before `horizon` and returns how many were added
+        """
+        charts = DockChart.objects.filter(end_time=None, expires_at__lte=horizon).order_by('expires_at')
+        added = 0
+        for chart_id, expires_at in charts.values_list('id', 'expires_at')[:limit]:
+            if self.push(chart_id, expires_at):
+                added += 1
+        return added
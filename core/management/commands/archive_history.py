@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import archive
+
+
+class Command(BaseCommand):
+    help = 'Moves closed dock charts and their fines and revenues to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ARCHIVE_AFTER_DAYS,
+                            help='Archive the charts closed more than this many days ago')
+        parser.add_argument('--purge-days', type=int, default=settings.ARCHIVE_PURGE_AFTER_DAYS,
+                            help='Delete the archived charts closed more than this many days ago')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of charts moved per transaction')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        chunk_size = options['chunk_size']
+
+        before = now - timezone.timedelta(days=options['days'])
+        archived = moved = archive.archive_chunk(before, chunk_size)
+        while moved:
+            moved = archive.archive_chunk(before, chunk_size)
+            archived += moved
+        self.stdout.write('Archived {} charts'.format(archived))
+
+        if options['purge_days'] is None:
+            return
+        before = now - timezone.timedelta(days=options['purge_days'])
+        purged = deleted = archive.purge_chunk(before, chunk_size)
+        while deleted:
+            deleted = archive.purge_chunk(before, chunk_size)
+            purged += deleted
+        self.stdout.write('Purged {} archived charts'.format(purged))
@@ -0,0 +1,70 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core.catalog import get_catalog
+from core.models import Dock, DockChart, Port, Ship, pirate_port_type_ids
+from player.models import Inventory, Profile
+
+
+class Command(BaseCommand):
+    help = 'Prints the query plans of the hot queries and flags sequential scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--generate', type=int, default=0,
+                            help='Generates a world of this many players first, see generate_world')
+        parser.add_argument('--analyze', action='store_true',
+                            help='Runs the queries with EXPLAIN ANALYZE to show actual timings')
+
+    def hot_queries(self):
+        """
+        (name, queryset or (sql, params)) of the queries behind the busiest endpoints
+        """
+        ship = Ship.objects.order_by('?').first()
+        port = Port.objects.filter(user__isnull=False).order_by('?').first()
+        if ship is None or port is None:
+            raise CommandError('There are no players, run with --generate')
+        user_id = ship.user_id
+        gold = get_catalog().item('Gold').id
+
+        return (
+            ('open chart of a ship', DockChart.objects.filter(ship_id=ship.id, end_time=None)),
+            ('open chart of a port', DockChart.objects.filter(port_id=port.id, end_time=None)),
+            ('expired charts', DockChart.objects.filter(end_time=None, expires_at__lte=timezone.now())
+                .order_by('expires_at')[:500]),
+            ('inventory item of a user', Inventory.objects.filter(user_id=user_id, item_id=gold)),
+            ('active ships of a user', Ship.objects.filter(user_id=user_id, is_active=True)),
+            ('locked docks of a user', Dock.objects.filter(user_id=user_id, status='locked')),
+            ('free docks of a user', Dock.objects.filter(user_id=user_id, ship_id=None)),
+            ('ports of a user', Port.objects.filter(user_id=user_id)),
+            ('leaderboard page', Profile.objects.order_by('rank', 'id').select_related('user')[:25]),
+            ('players ahead on points', Profile.objects.filter(points__gt=ship.user.profile.points)),
+            ('idle pirate port', ("SELECT id FROM core_port WHERE log_id IS NULL AND type_id = ANY(%s) "
+                                  "ORDER BY id LIMIT 1", [pirate_port_type_ids()])),
+        )
+
+    def handle(self, *args, **options):
+        if options['generate']:
+            call_command('generate_world', players=options['generate'], prefix='explain', stdout=self.stdout)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+        explain = 'EXPLAIN ANALYZE ' if options['analyze'] else 'EXPLAIN '
+        sequential = []
+        for name, query in self.hot_queries():
+            sql, params = query if isinstance(query, tuple) else query.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(explain + sql, params)
+                plan = [row[0] for row in cursor.fetchall()]
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for line in plan:
+                self.stdout.write('    ' + line)
+            if any('Seq Scan' in line for line in plan):
+                sequential.append(name)
+
+        if sequential:
+            self.stdout.write(self.style.WARNING('Sequential scans: ' + ', '.join(sequential)))
+        else:
+            self.stdout.write(self.style.SUCCESS('All hot queries use indexes'))
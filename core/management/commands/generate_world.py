@@ -0,0 +1,172 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.catalog import get_catalog
+from core.models import DOCKING_DURATION, Dock, DockChart, FineLog, Port, Ship, values_list_sql
+from player.models import Profile
+
+# Fine charged when a ship is caught at a non parking port, as in FineSerializer
+FINE_AMOUNT = 20
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic world of players, dockings and fines for scale testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=10000,
+                            help='Number of players to generate')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Number of players inserted per transaction')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed of the generator, the same seed builds the same world')
+        parser.add_argument('--prefix', default='player',
+                            help='Prefix of the generated usernames')
+        parser.add_argument('--docked', type=float, default=0.3,
+                            help='Fraction of the players whose raft is docked at another player\'s port')
+        parser.add_argument('--expired', type=float, default=0.2,
+                            help='Fraction of the dockings which have run out without being settled')
+        parser.add_argument('--fined', type=float, default=0.05,
+                            help='Fraction of the players whose raft has been fined before')
+        parser.add_argument('--max-items', type=int, default=500,
+                            help='Largest count of every item in the generated inventories')
+
+    def handle(self, *args, **options):
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError('Players named {}* exist already'.format(options['prefix']))
+
+        # Profiles pick their island from the global generator
+        random.seed(options['seed'])
+        self.now = timezone.now()
+        self.options = options
+        # Idle ports of the players generated so far, as (port id, owner id, penalizable)
+        self.idle_ports = []
+
+        catalog = get_catalog()
+        self.penalizable_type_id = catalog.non_parking_port_type.id
+        self.item_ids = [item.id for item in catalog.items]
+
+        for start in range(0, options['players'], options['chunk_size']):
+            stop = min(start + options['chunk_size'], options['players'])
+            with transaction.atomic():
+                self._generate(range(start, stop))
+            self.stdout.write('Generated {} players'.format(stop))
+
+    def _generate(self, indices):
+        prefix = self.options['prefix']
+        users = []
+        for index in indices:
+            user = User(username='{}{}'.format(prefix, index), email='{}{}@example.com'.format(prefix, index))
+            user.set_unusable_password()
+            users.append(user)
+        Profile.objects.create_players(users, batch_size=len(users))
+        user_ids = [user.id for user in users]
+
+        self._fill_inventories(user_ids)
+
+        ports = Port.objects.filter(user_id__in=user_ids).order_by('id').values_list('id', 'user_id', 'type_id')
+        self.idle_ports.extend((port_id, user_id, type_id == self.penalizable_type_id)
+                               for port_id, user_id, type_id in ports)
+
+        rafts = dict(Ship.objects.filter(user_id__in=user_ids).values_list('user_id', 'id'))
+        charts = []
+        for user_id in user_ids:
+            if random.random() < self.options['fined']:
+                chart = self._chart(rafts[user_id], user_id, fined=True)
+                if chart is not None:
+                    charts.append(chart)
+            if random.random() < self.options['docked']:
+                chart = self._chart(rafts[user_id], user_id, fined=False)
+                if chart is not None:
+                    charts.append(chart)
+        DockChart.objects.bulk_create(charts)
+
+        FineLog.objects.bulk_create([FineLog(amount=FINE_AMOUNT, dock_chart=chart)
+                                     for chart in charts if chart.end_time is not None])
+        self._point_at(chart for chart in charts if chart.end_time is None)
+
+    def _fill_inventories(self, user_ids):
+        rows = [(user_id, item_id, random.randint(0, self.options['max_items']))
+                for user_id in user_ids for item_id in self.item_ids]
+        experience = [(user_id, random.randint(10, 5000)) for user_id in user_ids]
+        with connection.cursor() as cursor:
+            values, params = values_list_sql(rows)
+            cursor.execute(
+                "UPDATE player_inventory inventory SET count = generated.count "
+                "FROM (" + values + ") AS generated (user_id, item_id, count) "
+                "WHERE inventory.user_id = generated.user_id AND inventory.item_id = generated.item_id",
+                params
+            )
+            values, params = values_list_sql(experience)
+            cursor.execute(
+                "UPDATE player_profile profile SET experience = generated.experience "
+                "FROM (" + values + ") AS generated (user_id, experience) "
+                "WHERE profile.user_id = generated.user_id",
+                params
+            )
+        Dock.objects.unlock_slots(user_ids)
+
+    def _take_idle_port(self, user_id, penalizable=None):
+        """
+        Removes and returns a random idle port of another player, None if none was found
+        """
+        for _ in range(10):
+            if not self.idle_ports:
+                return None
+            index = random.randrange(len(self.idle_ports))
+            port = self.idle_ports[index]
+            if port[1] == user_id or (penalizable is not None and port[2] != penalizable):
+                continue
+            self.idle_ports[index] = self.idle_ports[-1]
+            self.idle_ports.pop()
+            return port
+        return None
+
+    def _chart(self, ship_id, user_id, fined):
+        """
+        A chart of the ship at a random port: closed by a fine, running or run out
+        """
+        if fined:
+            # Fines are only charged at non parking ports, which stay idle after the ship leaves
+            port = self._take_idle_port(user_id, penalizable=True)
+            if port is None:
+                return None
+            self.idle_ports.append(port)
+            start_time = self.now - timezone.timedelta(minutes=random.uniform(60, 60 * 24 * 7))
+            return DockChart(ship_id=ship_id, port_id=port[0], start_time=start_time, is_success=False,
+                             end_time=start_time + timezone.timedelta(minutes=random.uniform(1, 29)))
+
+        port = self._take_idle_port(user_id)
+        if port is None:
+            return None
+        duration = DOCKING_DURATION.total_seconds() / 60
+        if random.random() < self.options['expired']:
+            minutes = random.uniform(duration, duration * 4)
+        else:
+            minutes = random.uniform(0, duration)
+        start_time = self.now - timezone.timedelta(minutes=minutes)
+        return DockChart(ship_id=ship_id, port_id=port[0], start_time=start_time,
+                         expires_at=start_time + DOCKING_DURATION)
+
+    def _point_at(self, charts):
+        """
+        Sets Port.log and Ship.log of the ports and ships of open charts, which bulk_create skips
+        """
+        rows = [(chart.port_id, chart.ship_id, chart.id) for chart in charts]
+        if not rows:
+            return
+        values, params = values_list_sql(rows)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE core_port port SET log_id = docked.chart_id "
+                "FROM (" + values + ") AS docked (port_id, ship_id, chart_id) WHERE port.id = docked.port_id",
+                params
+            )
+            cursor.execute(
+                "UPDATE core_ship ship SET log_id = docked.chart_id "
+                "FROM (" + values + ") AS docked (port_id, ship_id, chart_id) WHERE ship.id = docked.ship_id",
+                params
+            )
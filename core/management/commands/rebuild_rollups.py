@@ -0,0 +1,27 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the daily stats of past days from the dock charts and fines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Last day to rebuild as YYYY-MM-DD, yesterday by default')
+        parser.add_argument('--days', type=int, default=1, help='Number of days to rebuild up to --date')
+
+    def handle(self, *args, **options):
+        if options['date'] is None:
+            last = rollups.today() - datetime.timedelta(days=1)
+        else:
+            try:
+                last = datetime.datetime.strptime(options['date'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--date must be given as YYYY-MM-DD')
+
+        for offset in range(options['days'] - 1, -1, -1):
+            day = last - datetime.timedelta(days=offset)
+            rollups.rebuild(day)
+            self.stdout.write('Rebuilt the stats of {}'.format(day.isoformat()))
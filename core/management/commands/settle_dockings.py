@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.expiry import ExpiryQueue
+from core.models import DockChart
+
+
+class Command(BaseCommand):
+    help = 'Undocks ships whose docking time has run out'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of dockings settled per transaction')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds between scans for new dockings')
+        parser.add_argument('--once', action='store_true',
+                            help='Settle the dockings which have already run out and exit')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        lookahead = timezone.timedelta(seconds=options['interval'])
+        queue = ExpiryQueue()
+
+        while True:
+            now = timezone.now()
+            horizon = now if options['once'] else now + lookahead
+            added = queue.refill(horizon, limit=batch_size * 10)
+
+            settled = 0
+            due = queue.pop_due(timezone.now(), batch_size)
+            while due:
+                settled += DockChart.objects.settle(due)
+                due = queue.pop_due(timezone.now(), batch_size)
+            if settled:
+                self.stdout.write('Settled {} dockings'.format(settled))
+
+            if options['once']:
+                if not added:
+                    break
+                continue
+
+            wake_at = now + lookahead
+            next_due = queue.next_due()
+            if next_due is not None and next_due < wake_at:
+                wake_at = next_due
+            time.sleep(max((wake_at - timezone.now()).total_seconds(), 0))
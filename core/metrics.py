@@ -0,0 +1,213 @@
+"""
+Per view request metrics: SQL query count, SQL time, serializer time and total time
+
+MetricsMiddleware records every request into histograms kept in the worker, which MetricsView
+serves in the Prometheus text format. Queries are counted by a thin cursor wrapper, so the debug
+cursor stays off, and serializers are timed by wrapping is_valid and data of the DRF base serializer
+once. Requests over the METRICS_QUERY_BUDGET or METRICS_LATENCY_BUDGET (seconds) settings are logged
+when those are set.
+"""
+import logging
+import time
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock, local
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+from rest_framework.serializers import BaseSerializer, ListSerializer, Serializer
+
+logger = logging.getLogger(__name__)
+
+PREFIX = 'directme_'
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram(object):
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def exposition(self, name, view):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append('{}_bucket{{view="{}",le="{}"}} {}'.format(name, view, bound, cumulative))
+        lines.append('{}_bucket{{view="{}",le="+Inf"}} {}'.format(name, view, self.count))
+        lines.append('{}_sum{{view="{}"}} {}'.format(name, view, self.sum))
+        lines.append('{}_count{{view="{}"}} {}'.format(name, view, self.count))
+        return lines
+
+
+METRICS = (
+    ('request_duration_seconds', 'Time spent handling the request', TIME_BUCKETS),
+    ('sql_queries', 'SQL queries run by the request', QUERY_BUCKETS),
+    ('sql_duration_seconds', 'Time spent in SQL queries', TIME_BUCKETS),
+    ('serializer_duration_seconds', 'Time spent validating and serializing, queries run meanwhile included',
+     TIME_BUCKETS),
+)
+
+_histograms = {}
+_lock = Lock()
+_request = local()
+
+
+def observe(view, values):
+    """
+    Records the metrics of one request of `view`, `values` being in the order of METRICS
+    """
+    with _lock:
+        for (name, _, buckets), value in zip(METRICS, values):
+            histogram = _histograms.get((name, view))
+            if histogram is None:
+                histogram = _histograms[(name, view)] = Histogram(buckets)
+            histogram.observe(value)
+
+
+def exposition():
+    """
+    All the histograms in the Prometheus text format
+    """
+    lines = []
+    with _lock:
+        for name, help_text, _ in METRICS:
+            lines.append('# HELP {}{} {}'.format(PREFIX, name, help_text))
+            lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+            for (metric, view), histogram in sorted(_histograms.items()):
+                if metric == name:
+                    lines.extend(histogram.exposition(PREFIX + name, view))
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def _record_query(duration):
+    if getattr(_request, 'active', False):
+        _request.queries += 1
+        _request.sql_time += duration
+
+
+class _TimedCursorMixin(object):
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return super(_TimedCursorMixin, self).execute(sql, params)
+        finally:
+            _record_query(time.time() - start)
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return super(_TimedCursorMixin, self).executemany(sql, param_list)
+        finally:
+            _record_query(time.time() - start)
+
+
+class TimedCursorWrapper(_TimedCursorMixin, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(_TimedCursorMixin, CursorDebugWrapper):
+    pass
+
+
+def install(connection):
+    """
+    Makes the connection count and time its queries, without the formatting and logging of the debug cursor.
+    Django 1.10 has no execute_wrapper, so the cursor factories of the connection are replaced instead.
+    """
+    if getattr(connection, '_metrics_installed', False):
+        return
+    connection.make_cursor = lambda cursor: TimedCursorWrapper(cursor, connection)
+    connection.make_debug_cursor = lambda cursor: TimedCursorDebugWrapper(cursor, connection)
+    connection._metrics_installed = True
+
+
+def _timed(function):
+    """
+    Adds the time spent in `function` to the serializer time of the request. Serializers used
+    while another one is being timed, like nested ones, are part of its time.
+    """
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        if not getattr(_request, 'active', False) or _request.serializing:
+            return function(*args, **kwargs)
+        _request.serializing = True
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _request.serializing = False
+            _request.serializer_time += time.time() - start
+
+    return wrapper
+
+
+def instrument_serializers():
+    """
+    Times validation and representation of every serializer through the DRF classes they all extend
+    """
+    if getattr(BaseSerializer, '_metrics_installed', False):
+        return
+    for cls in (BaseSerializer, Serializer, ListSerializer):
+        if 'is_valid' in cls.__dict__:
+            cls.is_valid = _timed(cls.__dict__['is_valid'])
+        if 'data' in cls.__dict__:
+            cls.data = property(_timed(cls.__dict__['data'].fget))
+    BaseSerializer._metrics_installed = True
+
+
+class MetricsMiddleware(object):
+    """
+    Records the metrics of every request
+    """
+
+    def process_request(self, request):
+        install(connections[DEFAULT_DB_ALIAS])
+        instrument_serializers()
+        request._metrics_start = time.time()
+        request._metrics_view = None
+        _request.active = True
+        _request.queries = 0
+        _request.sql_time = 0
+        _request.serializing = False
+        _request.serializer_time = 0
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_view = view_func.__name__
+
+    def process_response(self, request, response):
+        if not hasattr(request, '_metrics_start'):
+            return response
+
+        duration = time.time() - request._metrics_start
+        _request.active = False
+        queries, sql_time = _request.queries, _request.sql_time
+        view = request._metrics_view or 'unresolved'
+        observe(view, (duration, queries, sql_time, _request.serializer_time))
+
+        query_budget = getattr(settings, 'METRICS_QUERY_BUDGET', None)
+        latency_budget = getattr(settings, 'METRICS_LATENCY_BUDGET', None)
+        if ((query_budget is not None and queries > query_budget) or
+                (latency_budget is not None and duration > latency_budget)):
+            logger.warning('%s %s (%s) took %.3fs with %d queries in %.3fs', request.method, request.path, view,
+                           duration, queries, sql_time)
+        return response
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_expires_at(apps, schema_editor):
+    DockChart = apps.get_model('core', 'DockChart')
+    DockChart.objects.filter(end_time=None).update(
+        expires_at=F('start_time') + django.utils.timezone.timedelta(minutes=30)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_auto_20170307_0256'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='dockchart',
+            name='start_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='dockchart',
+            name='expires_at',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+        migrations.RunPython(set_expires_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_dockchart_expires_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='port',
+            name='log',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='log', to='core.DockChart'),
+        ),
+        # Point every port at its open chart, if it has one
+        migrations.RunSQL(
+            "UPDATE core_port SET log_id = NULL; "
+            "UPDATE core_port SET log_id = open.id FROM ("
+            "  SELECT DISTINCT ON (port_id) id, port_id FROM core_dockchart "
+            "  WHERE end_time IS NULL ORDER BY port_id, id DESC"
+            ") AS open WHERE core_port.id = open.port_id",
+            migrations.RunSQL.noop,
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX core_port_idle_type_id ON core_port (type_id, id) WHERE log_id IS NULL",
+            "DROP INDEX core_port_idle_type_id",
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_port_log_idle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ship',
+            name='log',
+            field=models.ForeignKey(default=None, null=True, on_delete=django.db.models.deletion.SET_NULL,
+                                    related_name='+', to='core.DockChart'),
+        ),
+        # Point every ship at its open chart, if it has one
+        migrations.RunSQL(
+            "UPDATE core_ship SET log_id = open.id FROM ("
+            "  SELECT DISTINCT ON (ship_id) id, ship_id FROM core_dockchart "
+            "  WHERE end_time IS NULL ORDER BY ship_id, id DESC"
+            ") AS open WHERE core_ship.id = open.ship_id",
+            migrations.RunSQL.noop,
+        ),
+    ]
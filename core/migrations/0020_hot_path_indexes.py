@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_ship_log'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='dock',
+            index_together=set([('user', 'status')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='ship',
+            index_together=set([('user', 'is_active')]),
+        ),
+        # Free docks of a user
+        migrations.RunSQL(
+            "CREATE INDEX core_dock_empty_user_id ON core_dock (user_id) WHERE ship_id IS NULL",
+            "DROP INDEX core_dock_empty_user_id",
+        ),
+        # Open charts by ship, by port and by expiry
+        migrations.RunSQL(
+            "CREATE INDEX core_dockchart_open_ship_id ON core_dockchart (ship_id) WHERE end_time IS NULL",
+            "DROP INDEX core_dockchart_open_ship_id",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX core_dockchart_open_port_id ON core_dockchart (port_id) WHERE end_time IS NULL",
+            "DROP INDEX core_dockchart_open_port_id",
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX core_dockchart_open_expires_at ON core_dockchart (expires_at) WHERE end_time IS NULL",
+            "DROP INDEX core_dockchart_open_expires_at",
+        ),
+    ]
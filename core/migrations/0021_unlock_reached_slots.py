@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_hot_path_indexes'),
+        ('player', '0018_inventory_unique_user_item'),
+    ]
+
+    operations = [
+        # Docks were unlocked when their owner listed them, they are now unlocked as experience is gained
+        migrations.RunSQL(
+            "UPDATE core_dock dock SET status = 'buy' "
+            "FROM core_slot slot, core_level level, player_profile profile "
+            "WHERE dock.status = 'locked' AND slot.id = dock.slot_id AND level.id = slot.unlock_level_id "
+            "AND profile.user_id = dock.user_id AND profile.experience >= level.experience_required",
+            migrations.RunSQL.noop,
+        ),
+    ]
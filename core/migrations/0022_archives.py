@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_unlock_reached_slots'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedDockChart',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('start_time', models.DateTimeField()),
+                ('end_time', models.DateTimeField(db_index=True)),
+                ('expires_at', models.DateTimeField(default=None, null=True)),
+                ('is_success', models.BooleanField(default=False)),
+                ('port', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                                           related_name='+', to='core.Port')),
+                ('ship', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                                           related_name='+', to='core.Ship')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedFineLog',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('amount', models.IntegerField()),
+                ('dock_chart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fines',
+                                                 to='core.ArchivedDockChart')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedRevenueLog',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('item_collected', models.IntegerField()),
+                ('dock_chart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                 related_name='revenues', to='core.ArchivedDockChart')),
+                ('item', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING,
+                                           related_name='+', to='core.Item')),
+            ],
+        ),
+    ]
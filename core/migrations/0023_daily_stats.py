@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0022_archives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IslandDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dockings', models.IntegerField(default=0)),
+                ('undockings', models.IntegerField(default=0)),
+                ('fines', models.IntegerField(default=0)),
+                ('island', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                             to='core.Island')),
+            ],
+            options={
+                'verbose_name_plural': 'island daily stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='PlayerDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('earned', models.BigIntegerField(default=0)),
+                ('undockings', models.IntegerField(default=0)),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                           to='core.Item')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                           to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'player daily stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='PortDailyStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('dockings', models.IntegerField(default=0)),
+                ('fines', models.IntegerField(default=0)),
+                ('fine_amount', models.BigIntegerField(default=0)),
+                ('port', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                           to='core.Port')),
+            ],
+            options={
+                'verbose_name_plural': 'port daily stats',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='islanddailystats',
+            unique_together=set([('day', 'island')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='playerdailystats',
+            unique_together=set([('day', 'user', 'item')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='portdailystats',
+            unique_together=set([('day', 'port')]),
+        ),
+    ]
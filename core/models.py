@@ -2,38 +2,109 @@ import os
 from uuid import uuid4
 
 from django.contrib.auth.models import User
-from django.db import models
+from django.db import connection, models, transaction
 from django.utils import timezone
 
+from core.catalog import get_catalog
+
+# How long a ship stays docked before it is undocked automatically
+DOCKING_DURATION = timezone.timedelta(minutes=30)
+# Experience gained by the owner of a ship on undocking
+UNDOCK_EXPERIENCE = 50
+
+
+def values_list_sql(rows):
+    """
+    Returns a VALUES list with placeholders for `rows` and its flattened parameters
+    """
+    placeholders = ', '.join('(' + ', '.join(['%s'] * len(row)) + ')' for row in rows)
+    params = [value for row in rows for value in row]
+    return 'VALUES ' + placeholders, params
+
+
+def pirate_port_type_ids():
+    """
+    Ids of the port types which nobody owns
+    """
+    return [port_type.id for port_type in get_catalog().port_types if not port_type.ownable]
+
 
 class DockModelManager(models.Manager):
-    def create_initial_docks(self, user):
+    def listing(self, user_id):
+        """
+        Docks of a user with their ships, ship stores and open charts joined
+        """
+        return Dock.objects.filter(user_id=user_id).order_by('id').select_related(
+            'slot', 'ship__ship_store', 'ship__log__port__user__profile'
+        )
+
+    def listing_with_ships(self, user_id, ships):
+        """
+        Docks of a user joined to `ships`, loaded by Ship.objects.listing, instead of joining them again.
+        Docks holding any other ship load it on access.
+        """
+        ships = {ship.id: ship for ship in ships}
+        docks = list(Dock.objects.filter(user_id=user_id).order_by('id').select_related('slot'))
+        for dock in docks:
+            if dock.ship_id in ships:
+                dock.ship = ships[dock.ship_id]
+        return docks
+
+    def create_initial_docks(self, users, ships):
         """
-        Setup initial docs for a new user
+        Setup initial docks for new users, the first one unlocked with the user's ship from `ships`
         """
-        for slot in Slot.objects.all():
-            Dock.objects.create(user=user, slot=slot)
+        slots = get_catalog().slots.rows
+        docks = []
+        for user in users:
+            docks.append(Dock(user_id=user.id, slot_id=slots[0].id, ship=ships[user.id], status='unlocked'))
+            docks.extend(Dock(user_id=user.id, slot_id=slot.id) for slot in slots[1:])
+        Dock.objects.bulk_create(docks)
 
     def update_ship_docked(self, previous_ship, current_ship):
         dock_instance = Dock.objects.get(ship=previous_ship)
         dock_instance.ship = current_ship
         dock_instance.save()
 
-    def buy_slot(self, dock, user):
+    def pay_for_slot(self, dock, user):
+        """
+        Takes the gold of a dock from the user, returns False if the user doesn't have enough of it
+        """
+        catalog = get_catalog()
+        required_gold = catalog.slots.by_id[dock.slot_id].gold
+        from player.models import Inventory
+        return not Inventory.objects.debit(user, {catalog.item('Gold').id: required_gold})
+
+    def buy_slot(self, dock):
+        """
+        Unlocks a dock which has been paid for with pay_for_slot
+        """
         dock.status = 'unlocked'
-        required_gold = dock.slot.gold
-        from player.models import Inventory, Item
-        Inventory.objects.sub_item(user=user, item=Item.objects.get(name='Gold'), value=required_gold)
         dock.save()
 
-    def check_exp(self, user):
-        docks = Dock.objects.filter(user=user, status='locked')
-        exp = user.profile.experience
-        for dock in docks:
-            required_exp = dock.slot.unlock_level.experience_required
-            if exp >= required_exp:
-                dock.status = 'buy'
-                dock.save()
+    def unlock_slots(self, user_ids=None):
+        """
+        Makes the locked docks of the users, or of everyone when `user_ids` is None, buyable once their
+        experience reaches the level of the slot. Docks which have become buyable are never locked again.
+        """
+        catalog = get_catalog()
+        thresholds = [(slot.id, catalog.unlock_experience(slot.id)) for slot in catalog.slots]
+        if (user_ids is not None and not user_ids) or not thresholds:
+            return 0
+        values, params = values_list_sql(thresholds)
+        condition = ''
+        if user_ids is not None:
+            condition = 'dock.user_id = ANY(%s) AND '
+            params.append(list(user_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE core_dock dock SET status = 'buy' "
+                "FROM (" + values + ") AS slot (slot_id, experience_required), player_profile profile "
+                "WHERE " + condition + "dock.status = 'locked' AND dock.slot_id = slot.slot_id "
+                "AND profile.user_id = dock.user_id AND profile.experience >= slot.experience_required",
+                params
+            )
+            return cursor.rowcount
 
 
 # Garage
@@ -44,10 +115,15 @@ class Dock(models.Model):
     status = models.CharField(default='locked', max_length=10)
     objects = DockModelManager()
 
+    class Meta:
+        index_together = (('user', 'status'),)
+
     def allocate_raft(self):
         # Assign raft here
 
         ship = ShipStore.objects.buy_raft(user=self.user)
+        if ship is None:
+            return None
         self.ship = ship
         self.save()
 
@@ -56,84 +132,200 @@ class Dock(models.Model):
 
 class DockChartModelManager(models.Manager):
     def create_entry(self, ship_id, port_id):
-        return DockChart.objects.create(
+        dock_chart = DockChart.objects.create(
             ship=Ship.objects.get(pk=ship_id),
             port_id=port_id
         )
+        from core import rollups
+        rollups.docked([port_id])
+        return dock_chart
 
     def end_parking(self, port):
-        dock_chart = DockChart.objects.get(port=port, end_time=None)
+        dock_chart = DockChart.objects.get(pk=port.log_id, end_time=None)
         dock_chart.end_time = timezone.now()
         dock_chart.is_success = False
         dock_chart.save()
         return dock_chart
 
-    def undock_ship(self, ship, end_time=timezone.now()):
-        dock_chart = DockChart.objects.filter(ship=ship, end_time=None).first()
-        dock_chart.end_time = end_time
-        dock_chart.is_success = True
-        dock_chart.save()
-
-        user = Ship.objects.get(pk=ship.id).user
-        # TODO: Change item generation formula
-        time_fraction = timezone.now() - dock_chart.start_time
-        minutes = time_fraction.total_seconds() / 60
-        value = int(minutes) * dock_chart.ship.ship_store.cost_multiplier
-        from player.models import Inventory
-        Inventory.objects.add_item(user=user, item=dock_chart.port.user.profile.island.item, value=value)
-        # TODO: Change exp gain formula
-        from player.models import Profile
-        Profile.objects.add_exp(user.profile, 50)
+    def undock_ship(self, ship, end_time=None):
+        with transaction.atomic():
+            dock_chart = DockChart.objects.select_for_update().filter(ship=ship, end_time=None).first()
+            if dock_chart is None:
+                # Settled by someone else in the meantime
+                return None
+            if end_time is None:
+                # Like _settle, a docking pays up to its expiry at most
+                end_time = min(timezone.now(), dock_chart.expires_at)
+            dock_chart.end_time = end_time
+            dock_chart.is_success = True
+            dock_chart.save()
+
+            user = Ship.objects.get(pk=ship.id).user
+            # TODO: Change item generation formula
+            time_fraction = dock_chart.end_time - dock_chart.start_time
+            minutes = time_fraction.total_seconds() / 60
+            # Truncated like the payout of _settle
+            value = int(int(minutes) * dock_chart.ship.ship_store.cost_multiplier)
+            island = dock_chart.port.user.profile.island
+            from player.models import Inventory
+            Inventory.objects.add_item(user=user, item=island.item, value=value)
+            # TODO: Change exp gain formula
+            from player.models import Profile
+            Profile.objects.add_exp(user.profile, UNDOCK_EXPERIENCE)
+            from core import rollups
+            rollups.undocked([(user.id, island.id, island.item_id, 1, value)])
 
         return dock_chart
 
-    # undock timed out ships of a user
-    def undock_timedout(self, user_id):
-        ships = Ship.objects.filter(user_id=user_id)
-        for ship in ships:
-            dock_chart = DockChart.objects.filter(end_time=None, ship=ship)
-            for dock in dock_chart:
-                endtime = dock.start_time + timezone.timedelta(minutes=30)
-                if timezone.now() >= endtime:
-                    self.undock_ship(dock.ship, endtime)
+    def _settle(self, condition, params):
+        """
+        Closes the open charts matching `condition` at their expiry time and
+        credits the ship owners, using the same payout as `undock_ship`.
+        Issues the same statements however many charts are settled.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "WITH settled AS ("
+                "  UPDATE core_dockchart SET end_time = expires_at, is_success = TRUE"
+                "  WHERE end_time IS NULL AND " + condition +
+                "  RETURNING id, ship_id, port_id, start_time, end_time"
+                "), freed_ports AS ("
+                "  UPDATE core_port SET log_id = NULL WHERE log_id IN (SELECT id FROM settled)"
+                "), freed_ships AS ("
+                "  UPDATE core_ship SET log_id = NULL WHERE log_id IN (SELECT id FROM settled)"
+                ") "
+                "SELECT ship.user_id, island.id, island.item_id, COUNT(*), "
+                "  SUM(TRUNC(FLOOR(EXTRACT(EPOCH FROM settled.end_time - settled.start_time) / 60)"
+                "            * store.cost_multiplier)) "
+                "FROM settled "
+                "JOIN core_ship ship ON ship.id = settled.ship_id "
+                "JOIN core_shipstore store ON store.id = ship.ship_store_id "
+                "JOIN core_port port ON port.id = settled.port_id "
+                "JOIN player_profile owner ON owner.user_id = port.user_id "
+                "JOIN core_island island ON island.id = owner.island_id "
+                "GROUP BY ship.user_id, island.id, island.item_id",
+                params
+            )
+            payouts = cursor.fetchall()
+            if not payouts:
+                return 0
+
+            earned = {}
+            for user_id, _, item_id, _, value in payouts:
+                earned[(user_id, item_id)] = earned.get((user_id, item_id), 0) + int(value)
+            values, values_params = values_list_sql([
+                (user_id, item_id, value) for (user_id, item_id), value in earned.items()
+            ])
+            cursor.execute(
+                "UPDATE player_inventory inventory SET count = inventory.count + payout.value "
+                "FROM (" + values + ") AS payout (user_id, item_id, value) "
+                "WHERE inventory.user_id = payout.user_id AND inventory.item_id = payout.item_id",
+                values_params
+            )
+
+            undocked = {}
+            for user_id, _, _, count, _ in payouts:
+                undocked[user_id] = undocked.get(user_id, 0) + count
+            values, values_params = values_list_sql([
+                (user_id, count * UNDOCK_EXPERIENCE) for user_id, count in undocked.items()
+            ])
+            cursor.execute(
+                "UPDATE player_profile profile SET experience = profile.experience + gain.value "
+                "FROM (" + values + ") AS gain (user_id, value) "
+                "WHERE profile.user_id = gain.user_id",
+                values_params
+            )
+            Dock.objects.unlock_slots(list(undocked))
+            from core import rollups
+            rollups.undocked(payouts)
+
+        return sum(undocked.values())
+
+    def settle(self, chart_ids, now=None):
+        """
+        Undocks the ships of the given charts as of their expiry time.
+        Charts which have been closed in the meantime or are not due yet are skipped.
+        """
+        if not chart_ids:
+            return 0
+        if now is None:
+            now = timezone.now()
+        return self._settle('id = ANY(%s) AND expires_at <= %s', [list(chart_ids), now])
+
+    def settle_expired(self, user_id=None, now=None):
+        """
+        Undocks all timed out ships, or only those of the given user
+        """
+        if now is None:
+            now = timezone.now()
+        if user_id is None:
+            return self._settle('expires_at <= %s', [now])
+        return self._settle(
+            'expires_at <= %s AND ship_id IN (SELECT id FROM core_ship WHERE user_id = %s)', [now, user_id]
+        )
 
     def allocate_pirate_port(self, ship):
-        pirate_ports = Port.objects.filter(type__ownable=False)
-        for pirate_port in pirate_ports:
-            if DockChart.objects.filter(port=pirate_port, end_time=None).count() == 0:
-                return DockChart.objects.create(ship=ship, port=pirate_port)
+        """
+        Docks a ship at an idle pirate port, returns None if all of them are taken.
+        The port is claimed with SKIP LOCKED so that concurrent requests never get the same one.
+        """
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM core_port WHERE log_id IS NULL AND type_id = ANY(%s) "
+                "ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED",
+                [pirate_port_type_ids()]
+            )
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            dock_chart = DockChart.objects.create(ship=ship, port_id=row[0])
+            from core import rollups
+            rollups.docked([row[0]])
+            return dock_chart
 
     # check pirate port availability
     def is_available(self):
-        port_available = False
-        pirate_ports = Port.objects.filter(type__ownable=False)
-        for pirate_port in pirate_ports:
-            if DockChart.objects.filter(port=pirate_port, end_time=None).count() == 0:
-                port_available = True
-                break
-
-        if port_available:
-            return True
-        else:
-            return False
+        return Port.objects.filter(type_id__in=pirate_port_type_ids(), log=None).exists()
 
 
 class DockChart(models.Model):
-    start_time = models.DateTimeField(auto_now_add=True)
+    start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(default=None, null=True)
+    # When an open docking runs out, kept in sync with start_time.
+    # Indexed for open charts only, see migration 0020_hot_path_indexes.
+    expires_at = models.DateTimeField(default=None, null=True)
     is_success = models.BooleanField(default=False)
     ship = models.ForeignKey('Ship', related_name='ships')
     port = models.ForeignKey('Port', related_name='ports')
 
     objects = DockChartModelManager()
 
+    def save(self, *args, **kwargs):
+        if self.end_time is None:
+            self.expires_at = self.start_time + DOCKING_DURATION
+        adding = self._state.adding
+        result = super(DockChart, self).save(*args, **kwargs)
+
+        # Keep the port and the ship pointing at the chart which occupies them
+        if self.end_time is None:
+            if adding:
+                Port.objects.filter(pk=self.port_id).update(log=self)
+                Ship.objects.filter(pk=self.ship_id).update(log=self)
+        else:
+            Port.objects.filter(pk=self.port_id, log=self).update(log=None)
+            Ship.objects.filter(pk=self.ship_id, log=self).update(log=None)
+        return result
+
     def __str__(self):
         return self.ship.ship_store.name + " : " + str(self.start_time)
 
 
 class FineLogModelManager(models.Manager):
     def create_log(self, amount, dock_chart):
-        return FineLog.objects.create(amount=amount, dock_chart=dock_chart)
+        fine_log = FineLog.objects.create(amount=amount, dock_chart=dock_chart)
+        from core import rollups
+        rollups.fined(dock_chart.port_id, amount)
+        return fine_log
 
 
 class FineLog(models.Model):
@@ -168,41 +360,31 @@ class Level(models.Model):
         return str(self.level_number)
 
 
-class PortTypeModelManager(models.Manager):
-    def get_parking_port(self):
-        return PortType.objects.get(penalizable=False, ownable=True)
-
-    def get_non_parking_port(self):
-        return PortType.objects.get(penalizable=True, ownable=True)
-
-
 class PortType(models.Model):
     name = models.CharField(max_length=255)
     penalizable = models.BooleanField(default=True)
     ownable = models.BooleanField(default=True)
 
-    objects = PortTypeModelManager()
-
     def __str__(self):
         return self.name
 
 
 class PortModelManager(models.Manager):
-    def _create_parking_port(self, user):
-        return Port.objects.create(user=user, type=PortType.objects.get_parking_port())
-
-    def _create_non_parking_port(self, user):
-        return Port.objects.create(user=user, type=PortType.objects.get_non_parking_port())
-
-    def create_initial_ports(self, user):
+    def listing(self, user_id):
         """
-        Creates parking and non parking ports of a user
+        Ports of a user with their type and open chart, along with the docked ship and its owner
         """
-        for _ in range(2):
-            self._create_parking_port(user=user)
+        return Port.objects.filter(user_id=user_id).order_by('id').select_related(
+            'type', 'log__ship__ship_store', 'log__ship__user'
+        )
 
-        for _ in range(3):
-            self._create_non_parking_port(user=user)
+    def create_initial_ports(self, users):
+        """
+        Creates parking and non parking ports of new users
+        """
+        catalog = get_catalog()
+        type_ids = [catalog.parking_port_type.id] * 2 + [catalog.non_parking_port_type.id] * 3
+        Port.objects.bulk_create([Port(user_id=user.id, type_id=type_id) for user in users for type_id in type_ids])
 
     def get_parking_ports(self, user):
         return Port.objects.filter(user=user, type__ownable=True, type__penalizable=False)
@@ -211,17 +393,15 @@ class PortModelManager(models.Manager):
         return Port.objects.filter(user=user, type__ownable=True, type__penalizable=True)
 
     def pirate_port_available(self):
-        pirate_ports = Port.objects.filter(type__ownable=False)
-        if pirate_ports.count() == 0:
-            return False
-        return True
+        return Port.objects.filter(type_id__in=pirate_port_type_ids()).exists()
 
 
 # Parking
 class Port(models.Model):
     user = models.ForeignKey(User, related_name='user')
     type = models.ForeignKey('PortType', related_name='port')
-    log = models.ForeignKey('DockChart', default=None, null=True, related_name='log')
+    # Open chart of the ship docked at the port, None while the port is idle
+    log = models.ForeignKey('DockChart', default=None, null=True, related_name='log', on_delete=models.SET_NULL)
 
     objects = PortModelManager()
 
@@ -231,9 +411,7 @@ class Port(models.Model):
         return False
 
     def is_idle(self):
-        if DockChart.objects.filter(port=self, end_time=None).count() == 0:
-            return True
-        return False
+        return self.log_id is None
 
     def __str__(self):
         return self.user.username + " : " + self.type.name
@@ -245,6 +423,84 @@ class RevenueLog(models.Model):
     dock_chart = models.ForeignKey('DockChart')
 
 
+# Closed charts and their logs moved out of the hot tables by core.archive, keeping their ids.
+# Ships and ports are referenced without constraints so that the archive never blocks deleting them.
+class ArchivedDockChart(models.Model):
+    id = models.IntegerField(primary_key=True)
+    start_time = models.DateTimeField()
+    end_time = models.DateTimeField(db_index=True)
+    expires_at = models.DateTimeField(default=None, null=True)
+    is_success = models.BooleanField(default=False)
+    ship = models.ForeignKey('Ship', related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    port = models.ForeignKey('Port', related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+
+
+class ArchivedFineLog(models.Model):
+    id = models.IntegerField(primary_key=True)
+    amount = models.IntegerField()
+    dock_chart = models.ForeignKey('ArchivedDockChart', related_name='fines')
+
+
+class ArchivedRevenueLog(models.Model):
+    id = models.IntegerField(primary_key=True)
+    item_collected = models.IntegerField()
+    item = models.ForeignKey('Item', related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    dock_chart = models.ForeignKey('ArchivedDockChart', related_name='revenues')
+
+
+# Daily totals kept up to date by core.rollups as ships dock, undock and get fined
+class PlayerDailyStats(models.Model):
+    day = models.DateField()
+    user = models.ForeignKey(User, related_name='+')
+    item = models.ForeignKey('Item', related_name='+')
+    earned = models.BigIntegerField(default=0)
+    undockings = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'user', 'item')
+        verbose_name_plural = 'player daily stats'
+
+
+class PortDailyStats(models.Model):
+    day = models.DateField()
+    port = models.ForeignKey('Port', related_name='+')
+    dockings = models.IntegerField(default=0)
+    fines = models.IntegerField(default=0)
+    fine_amount = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'port')
+        verbose_name_plural = 'port daily stats'
+
+
+class IslandDailyStats(models.Model):
+    day = models.DateField()
+    island = models.ForeignKey('Island', related_name='+')
+    dockings = models.IntegerField(default=0)
+    undockings = models.IntegerField(default=0)
+    fines = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'island')
+        verbose_name_plural = 'island daily stats'
+
+
+class ShipModelManager(models.Manager):
+    def listing(self, user_id):
+        """
+        Active ships of a user with their ship stores and open charts joined
+        """
+        return self.owned(user_id).filter(is_active=True)
+
+    def owned(self, user_id):
+        """
+        Active and upgraded ships of a user with their ship stores and open charts joined
+        """
+        return Ship.objects.filter(user_id=user_id).order_by('id').select_related(
+            'ship_store', 'log__port__user__profile'
+        )
+
+
 class Ship(models.Model):
     ship_store = models.ForeignKey('ShipStore')
     user = models.ForeignKey(User)
@@ -252,9 +508,16 @@ class Ship(models.Model):
     is_active = models.BooleanField(default=True)
     upgrade_to = models.ForeignKey("self", default=None, null=True, blank=True)
     upgraded_at = models.DateTimeField(blank=True, null=True)
+    # Open chart of the ship, None while the ship is idle
+    log = models.ForeignKey('DockChart', default=None, null=True, related_name='+', on_delete=models.SET_NULL)
+
+    objects = ShipModelManager()
+
+    class Meta:
+        index_together = (('user', 'is_active'),)
 
     def update(self, next_ship_store, user):
-        next_ship_instance = Ship.objects.create(ship_store=next_ship_store, user=user)
+        next_ship_instance = Ship.objects.create(ship_store_id=next_ship_store.id, user=user)
         self.is_active = False
         self.upgrade_to = next_ship_instance
         self.upgraded_at = timezone.now()
@@ -262,27 +525,11 @@ class Ship(models.Model):
 
         return next_ship_instance
 
-    def check_inventory(self, user):
-        ships = ShipStore.objects.filter(buy_cost__gt=self.ship_store.buy_cost).order_by('buy_cost')
-        upgrade_to_ship = ships.exclude(ship=self).first()
-        items_required = ShipUpgrade.objects.filter(ship_store=upgrade_to_ship)
-        from player.models import Inventory
-        user_items = Inventory.objects.filter(user=user)
-        for item_required in items_required:
-            item_acquired = user_items.get(item=item_required.item_id)
-            if item_required.count > item_acquired.count:
-                return False
-        return True
-
     def belongs_to(self, user):
-        if self.user == user:
-            return True
-        return False
+        return self.user_id == user.id
 
     def is_idle(self):
-        if DockChart.objects.filter(ship=self, end_time=None).count() == 0:
-            return True
-        return False
+        return self.log_id is None
 
     def __str__(self):
         return self.user.username + " : " + self.ship_store.name
@@ -290,31 +537,26 @@ class Ship(models.Model):
 
 class ShipStoreModelManager(models.Manager):
     def buy_raft(self, user):
-        raft = ShipStore.objects.order_by('buy_cost').first()
-        ship = Ship.objects.create(ship_store=raft, user=user)
+        """
+        Buys a raft for its gold, returns None if the user doesn't have enough of it
+        """
+        catalog = get_catalog()
+        raft = catalog.raft
 
         # Decrement user gold
-
         from player.models import Inventory
-        gold = Inventory.objects.filter(user=user, item__name__icontains='Gold').first()
-        gold.count -= ship.ship_store.buy_cost
-        gold.save()
+        if Inventory.objects.debit(user, {catalog.item('Gold').id: raft.buy_cost}):
+            return None
 
-        ship.save()
-        return ship
+        return Ship.objects.create(ship_store_id=raft.id, user=user)
 
-    def allocate_initial_ship(self, user):
+    def allocate_initial_ships(self, users):
         """
-        Assigns initial raft to the user
+        Creates the initial raft of new users, returns them by user id
         """
-        raft = ShipStore.objects.order_by('buy_cost').first()
-        ship = Ship.objects.create(ship_store=raft, user=user)
-        dock = Dock.objects.filter(user=user).first()
-        dock.status = 'unlocked'
-        dock.ship = ship
-        dock.save()
-
-        return ship
+        raft_id = get_catalog().raft.id
+        ships = Ship.objects.bulk_create([Ship(ship_store_id=raft_id, user_id=user.id) for user in users])
+        return {ship.user_id: ship for ship in ships}
 
 
 def upload_ship_image(instance, filename):
@@ -347,15 +589,12 @@ class ShipStore(models.Model):
 
 class ShipUpgradeModelManager(models.Manager):
     def consume_inventory(self, ship, user):
-        ships = ShipStore.objects.filter(buy_cost__gt=ship.ship_store.buy_cost).order_by('buy_cost')
-        upgrade_to_shipstore = ships.exclude(ship=ship).first()
-        items_required = ShipUpgrade.objects.filter(ship_store=upgrade_to_shipstore)
+        catalog = get_catalog()
+        upgrade_to_shipstore = catalog.next_ship_store(ship.ship_store_id)
+        items_required = catalog.upgrades_for(upgrade_to_shipstore.id)
         from player.models import Inventory
-        user_items = Inventory.objects.filter(user=user)
-        for item_required in items_required:
-            item_acquired = user_items.get(item=item_required.item_id)
-            item_acquired.count -= item_required.count
-            item_acquired.save()
+        if Inventory.objects.debit(user, {item.item_id: item.count for item in items_required}):
+            return None
 
         return upgrade_to_shipstore
 
@@ -381,6 +620,11 @@ class Slot(models.Model):
         return str(self.id) + " : " + str(self.unlock_level)
 
 
+# Single row holding the version stamp of core.catalog, bumped whenever a catalog model changes
+class CatalogVersion(models.Model):
+    version = models.BigIntegerField(default=1)
+
+
 class Version(models.Model):
     platform = models.CharField(max_length=255)
     version = models.CharField(max_length=255)
@@ -0,0 +1,205 @@
+"""
+Daily economy totals per player, port and island
+
+Every docking, undocking and fine adds to the rows of the day it happens on with INSERT ... ON CONFLICT,
+so the stats are read from a few rows instead of scanning the charts and logs. The rows are written once
+the request's transaction commits, in key order, so that their locks are held for one statement only and
+concurrent writers take them in the same order. Counters lost to a crash or a failed write are recomputed
+from the charts and fines, archived ones included, by `rebuild` and the rebuild_rollups command.
+"""
+import datetime
+import logging
+from collections import OrderedDict
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import values_list_sql
+
+logger = logging.getLogger(__name__)
+
+# Charts and fines, whether they have been archived or not
+SOURCES = (
+    "WITH charts AS ("
+    "  SELECT id, start_time, end_time, is_success, ship_id, port_id FROM core_dockchart"
+    "  UNION ALL SELECT id, start_time, end_time, is_success, ship_id, port_id FROM core_archiveddockchart"
+    "), fines AS ("
+    "  SELECT amount, dock_chart_id FROM core_finelog"
+    "  UNION ALL SELECT amount, dock_chart_id FROM core_archivedfinelog"
+    ") "
+)
+
+
+def today():
+    return timezone.localtime(timezone.now()).date()
+
+
+def _increments(counters, table):
+    return ', '.join('{0} = {1}.{0} + EXCLUDED.{0}'.format(counter, table) for counter in counters)
+
+
+def _upsert(cursor, table, keys, counters, rows):
+    """
+    Adds the counters of `rows` (keys followed by counters) to the rows of `table`, creating missing ones
+    """
+    merged = OrderedDict()
+    for row in rows:
+        key = tuple(row[:len(keys)])
+        totals = merged.get(key)
+        if totals is None:
+            merged[key] = list(row[len(keys):])
+        else:
+            for index, value in enumerate(row[len(keys):]):
+                totals[index] += value
+    if not merged:
+        return
+
+    values, params = values_list_sql([key + tuple(merged[key]) for key in sorted(merged)])
+    cursor.execute(
+        "INSERT INTO " + table + " (" + ', '.join(keys + counters) + ") " + values + " "
+        "ON CONFLICT (" + ', '.join(keys) + ") DO UPDATE SET " + _increments(counters, table),
+        params
+    )
+
+
+def _upsert_owner_islands(cursor, day, events):
+    """
+    Adds (port id, dockings, fines) rows to the island of the owner of each port
+    """
+    values, params = values_list_sql(events)
+    cursor.execute(
+        "INSERT INTO core_islanddailystats (day, island_id, dockings, undockings, fines) "
+        "SELECT %s, profile.island_id, SUM(event.dockings), 0, SUM(event.fines) "
+        "FROM (" + values + ") AS event (port_id, dockings, fines) "
+        "JOIN core_port port ON port.id = event.port_id "
+        "JOIN player_profile profile ON profile.user_id = port.user_id "
+        "WHERE profile.island_id IS NOT NULL "
+        "GROUP BY profile.island_id ORDER BY profile.island_id "
+        "ON CONFLICT (day, island_id) DO UPDATE SET " +
+        _increments(['dockings', 'fines'], 'core_islanddailystats'),
+        [day] + params
+    )
+
+
+def _after_commit(write):
+    """
+    Runs `write` once the current transaction commits, without failing the request it belongs to
+    """
+
+    def run():
+        try:
+            write()
+        except Exception:
+            logger.exception('Could not update the daily stats, run rebuild_rollups for today to fix them')
+
+    transaction.on_commit(run)
+
+
+def docked(port_ids, day=None):
+    """
+    Records a docking at each of `port_ids` once the current transaction commits
+    """
+    day = day or today()
+    port_ids = list(port_ids)
+
+    def write():
+        with connection.cursor() as cursor:
+            _upsert(cursor, 'core_portdailystats', ['day', 'port_id'], ['dockings', 'fines', 'fine_amount'],
+                    [(day, port_id, 1, 0, 0) for port_id in port_ids])
+            _upsert_owner_islands(cursor, day, [(port_id, 1, 0) for port_id in port_ids])
+
+    if port_ids:
+        _after_commit(write)
+
+
+def undocked(payouts, day=None):
+    """
+    Records undockings from (ship owner id, island id, item id, undockings, items earned) rows
+    once the current transaction commits
+    """
+    day = day or today()
+    payouts = list(payouts)
+
+    def write():
+        with connection.cursor() as cursor:
+            _upsert(cursor, 'core_playerdailystats', ['day', 'user_id', 'item_id'], ['earned', 'undockings'],
+                    [(day, user_id, item_id, int(earned), count) for user_id, _, item_id, count, earned in payouts])
+            _upsert(cursor, 'core_islanddailystats', ['day', 'island_id'], ['dockings', 'undockings', 'fines'],
+                    [(day, island_id, 0, count, 0) for _, island_id, _, count, _ in payouts])
+
+    if payouts:
+        _after_commit(write)
+
+
+def fined(port_id, amount, day=None):
+    """
+    Records a fine of `amount` charged to a ship at the port once the current transaction commits
+    """
+    day = day or today()
+
+    def write():
+        with connection.cursor() as cursor:
+            _upsert(cursor, 'core_portdailystats', ['day', 'port_id'], ['dockings', 'fines', 'fine_amount'],
+                    [(day, port_id, 0, 1, amount)])
+            _upsert_owner_islands(cursor, day, [(port_id, 0, 1)])
+
+    _after_commit(write)
+
+
+def rebuild(day):
+    """
+    Recomputes the rows of `day` from the charts and fines. Dockings count on the day they started,
+    undockings and fines on the day the chart was closed.
+    """
+    start = timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+    end = timezone.make_aware(datetime.datetime.combine(day + datetime.timedelta(days=1), datetime.time.min))
+    with transaction.atomic(), connection.cursor() as cursor:
+        for table in ('core_playerdailystats', 'core_portdailystats', 'core_islanddailystats'):
+            cursor.execute("DELETE FROM " + table + " WHERE day = %s", [day])
+
+        cursor.execute(
+            SOURCES +
+            "INSERT INTO core_playerdailystats (day, user_id, item_id, earned, undockings) "
+            "SELECT %s, ship.user_id, island.item_id, "
+            "  SUM(TRUNC(FLOOR(EXTRACT(EPOCH FROM chart.end_time - chart.start_time) / 60)"
+            "            * store.cost_multiplier)), COUNT(*) "
+            "FROM charts chart "
+            "JOIN core_ship ship ON ship.id = chart.ship_id "
+            "JOIN core_shipstore store ON store.id = ship.ship_store_id "
+            "JOIN core_port port ON port.id = chart.port_id "
+            "JOIN player_profile owner ON owner.user_id = port.user_id "
+            "JOIN core_island island ON island.id = owner.island_id "
+            "WHERE chart.is_success AND chart.end_time >= %s AND chart.end_time < %s "
+            "GROUP BY ship.user_id, island.item_id",
+            [day, start, end]
+        )
+        cursor.execute(
+            SOURCES +
+            "INSERT INTO core_portdailystats (day, port_id, dockings, fines, fine_amount) "
+            "SELECT %s, event.port_id, SUM(event.dockings), SUM(event.fines), SUM(event.amount) FROM ("
+            "  SELECT port_id, 1 AS dockings, 0 AS fines, 0 AS amount FROM charts"
+            "  WHERE start_time >= %s AND start_time < %s"
+            "  UNION ALL SELECT chart.port_id, 0, 1, fine.amount FROM fines fine"
+            "  JOIN charts chart ON chart.id = fine.dock_chart_id"
+            "  WHERE chart.end_time >= %s AND chart.end_time < %s"
+            ") AS event GROUP BY event.port_id",
+            [day, start, end, start, end]
+        )
+        cursor.execute(
+            SOURCES +
+            "INSERT INTO core_islanddailystats (day, island_id, dockings, undockings, fines) "
+            "SELECT %s, profile.island_id, SUM(event.dockings), SUM(event.undockings), SUM(event.fines) FROM ("
+            "  SELECT port_id, 1 AS dockings, 0 AS undockings, 0 AS fines FROM charts"
+            "  WHERE start_time >= %s AND start_time < %s"
+            "  UNION ALL SELECT port_id, 0, 1, 0 FROM charts"
+            "  WHERE is_success AND end_time >= %s AND end_time < %s"
+            "  UNION ALL SELECT chart.port_id, 0, 0, 1 FROM fines fine"
+            "  JOIN charts chart ON chart.id = fine.dock_chart_id"
+            "  WHERE chart.end_time >= %s AND chart.end_time < %s"
+            ") AS event "
+            "JOIN core_port port ON port.id = event.port_id "
+            "JOIN player_profile profile ON profile.user_id = port.user_id "
+            "WHERE profile.island_id IS NOT NULL "
+            "GROUP BY profile.island_id",
+            [day, start, end, start, end, start, end]
+        )
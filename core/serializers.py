@@ -1,12 +1,16 @@
 import hashlib
 import urllib.parse
 from django.contrib.auth.models import User
-from django.db.models import Sum
 from rest_framework import serializers
 
-from core.models import ShipStore, ShipUpgrade, Version, DockChart, Dock, Port, Ship, FineLog, Island, Item
+from core.catalog import get_catalog
+from core.models import ShipStore, ShipUpgrade, Version, DockChart, Dock, Port, Ship, FineLog, PlayerDailyStats, \
+    PortDailyStats, IslandDailyStats
 from player.models import Profile
 
+# Items a ship can be paid for with instead of gold
+RESOURCES = ('Coconut', 'Timber', 'Banana', 'Bamboo')
+
 
 class BuyShipSerializer(serializers.Serializer):
     ship_id = serializers.IntegerField(required=True)
@@ -16,7 +20,8 @@ class BuyShipSerializer(serializers.Serializer):
         user = self.context['request'].user
         ship_id = attrs['ship_id']
         pay_type = attrs['pay_type'].upper()
-        if not ShipStore.objects.filter(id=ship_id).exists():
+        catalog = get_catalog()
+        if ship_id not in catalog.ship_stores.by_id:
             raise serializers.ValidationError("Incorrect ship ID")
         if pay_type not in ['GOLD', 'RESOURCE']:
             raise serializers.ValidationError("Incorrect payment type")
@@ -24,66 +29,35 @@ class BuyShipSerializer(serializers.Serializer):
         dock = Dock.objects.filter(user=user, ship_id=None, status='unlocked').first()
         if dock is None:
             raise serializers.ValidationError("No available slot.")
-        ship_lvl = ShipStore.objects.get(id=ship_id).ship_lvl
+        ship_lvl = catalog.ship_stores.by_id[ship_id].ship_lvl
+
+        cost = catalog.cumulative_cost(ship_lvl)
 
-        # Check if user has sufficient funds to buy raft or not
+        # Taking the funds is the check, so two requests can't spend them twice
         if pay_type == 'GOLD':
-            user_gold = Inventory.objects.get(user=user, item__name='Gold').count
-            buy_cost = ShipStore.objects.filter(ship_lvl__lte=ship_lvl).aggregate(Sum('buy_cost'))
-            attrs['buy_cost'] = buy_cost
-            if user_gold < buy_cost['buy_cost__sum']:
+            if Inventory.objects.debit(user, {catalog.item('Gold').id: cost.gold}):
                 raise serializers.ValidationError("User doesn't have sufficient Gold")
 
         if pay_type == 'RESOURCE':
-            coconut_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=ship_lvl,
-                                                          item_id__name='Coconut').aggregate(Sum('count'))
-            timber_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=ship_lvl,
-                                                         item_id__name='Timber').aggregate(Sum('count'))
-            banana_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=ship_lvl,
-                                                         item_id__name='Banana').aggregate(Sum('count'))
-            bamboo_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=ship_lvl,
-                                                         item_id__name='Bamboo').aggregate(Sum('count'))
-            attrs['coconut_required'] = coconut_required
-            attrs['timber_required'] = timber_required
-            attrs['banana_required'] = banana_required
-            attrs['bamboo_required'] = bamboo_required
-            user_items = Inventory.objects.filter(user=user)
-            insufficient = []
-            if user_items.get(item__name='Coconut').count < coconut_required['count__sum']:
-                insufficient.append('Coconut')
-            if user_items.get(item__name='Timber').count < timber_required['count__sum']:
-                insufficient.append('Timber')
-            if user_items.get(item__name='Banana').count < banana_required['count__sum']:
-                insufficient.append('Banana')
-            if user_items.get(item__name='Bamboo').count < bamboo_required['count__sum']:
-                insufficient.append('Bamboo')
-            if len(insufficient):
-                raise serializers.ValidationError('User has insufficient ' + ','.join(insufficient))
+            failed = Inventory.objects.debit(user, {catalog.item(name).id: cost.items.get(name, 0)
+                                                    for name in RESOURCES})
+            if failed:
+                raise serializers.ValidationError(
+                    'User has insufficient ' + ','.join(name for name in RESOURCES if catalog.item(name).id in failed)
+                )
 
         return attrs
 
     def save(self):
         user = self.context['request'].user
         ship_id = self.validated_data['ship_id']
-        ship_lvl = ShipStore.objects.get(pk=ship_id).ship_lvl
+        catalog = get_catalog()
+        ship_lvl = catalog.ship_stores.by_id[ship_id].ship_lvl
         Profile.objects.cumulative_ship_level(user=user, level_delta=ship_lvl)
         dock = Dock.objects.filter(user=user, ship_id=None).first()
         ship = Ship.objects.create(ship_store_id=ship_id, user=user)
         dock.ship = ship
         dock.save()
-        pay_type = self.validated_data['pay_type'].upper()
-        if pay_type == 'GOLD':
-            Inventory.objects.sub_item(user=user, item=Item.objects.get(name='Gold'),
-                                       value=self.validated_data['buy_cost']['buy_cost__sum'])
-        if pay_type == 'RESOURCE':
-            Inventory.objects.sub_item(user=user, item=Item.objects.get(name='Coconut'),
-                                       value=self.validated_data['coconut_required']['count__sum'])
-            Inventory.objects.sub_item(user=user, item=Item.objects.get(name='Timber'),
-                                       value=self.validated_data['timber_required']['count__sum'])
-            Inventory.objects.sub_item(user=user, item=Item.objects.get(name='Banana'),
-                                       value=self.validated_data['banana_required']['count__sum'])
-            Inventory.objects.sub_item(user=user, item=Item.objects.get(name='Bamboo'),
-                                       value=self.validated_data['bamboo_required']['count__sum'])
 
 
 class DockPirateIslandSerializer(serializers.Serializer):
@@ -109,7 +83,10 @@ class DockPirateIslandSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         ship = Ship.objects.get(pk=validated_data['ship_id'])
-        return DockChart.objects.allocate_pirate_port(ship)
+        dock_chart = DockChart.objects.allocate_pirate_port(ship)
+        if dock_chart is None:
+            raise serializers.ValidationError('No idle pirate port available')
+        return dock_chart
 
 
 class DockChartSerializer(serializers.ModelSerializer):
@@ -118,12 +95,10 @@ class DockChartSerializer(serializers.ModelSerializer):
     ship_image = serializers.SerializerMethodField()
 
     def get_username(self, obj):
-        username = Ship.objects.get(pk=obj.ship_id).user.username
-        return username
+        return obj.ship.user.username
 
     def get_user_id(self, obj):
-        user_id = Ship.objects.get(pk=obj.ship_id).user_id
-        return user_id
+        return obj.ship.user_id
 
     def get_ship_image(self, obj):
         return obj.ship.ship_store.image.url
@@ -133,6 +108,22 @@ class DockChartSerializer(serializers.ModelSerializer):
         fields = ('ship', 'ship_image', 'start_time', 'end_time', 'is_success', 'username', 'user_id')
 
 
+def _active_chart(ship):
+    """
+    Returns the open chart of a ship, joined by the listings through Ship.log
+    """
+    if ship is None or ship.log_id is None:
+        return None
+    return ship.log
+
+
+def gravatar_url(email):
+    return "https://www.gravatar.com/avatar/%s?%s" % (
+        hashlib.md5(email.lower().encode('utf-8')).hexdigest(),
+        urllib.parse.urlencode({'s': str(40), 'd': 'identicon'})
+    )
+
+
 class DocksListSerializer(serializers.ModelSerializer):
     name = serializers.SerializerMethodField()
     ship_image = serializers.SerializerMethodField()
@@ -150,15 +141,15 @@ class DocksListSerializer(serializers.ModelSerializer):
     next_ship_store_id = serializers.SerializerMethodField()
 
     def get_name(self, obj):
-        if Ship.objects.filter(pk=obj.ship_id).exists():
-            return Ship.objects.get(pk=obj.ship_id).ship_store.name
+        if obj.ship is not None:
+            return obj.ship.ship_store.name
 
     def get_ship_image(self, obj):
-        if Ship.objects.filter(pk=obj.ship_id).exists():
-            return Ship.objects.get(pk=obj.ship_id).ship_store.image.url
+        if obj.ship is not None:
+            return obj.ship.ship_store.image.url
 
     def get_ship_status(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
+        if _active_chart(obj.ship) is not None:
             return "Busy"
         elif obj.ship_id is None:
             return None
@@ -166,46 +157,41 @@ class DocksListSerializer(serializers.ModelSerializer):
             return "Idle"
 
     def get_island_id(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
-            island_id = DockChart.objects.get(ship_id=obj.ship_id, end_time=None).port.user.profile.island_id
-            return island_id
+        dock_chart = _active_chart(obj.ship)
+        if dock_chart is not None:
+            return dock_chart.port.user.profile.island_id
 
     def get_park_time(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
-            park_time = DockChart.objects.get(ship_id=obj.ship_id, end_time=None).start_time
-            return park_time
+        dock_chart = _active_chart(obj.ship)
+        if dock_chart is not None:
+            return dock_chart.start_time
 
     def get_port_id(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
-            port_id = DockChart.objects.get(ship_id=obj.ship_id, end_time=None).port.id
-            return port_id
+        dock_chart = _active_chart(obj.ship)
+        if dock_chart is not None:
+            return dock_chart.port_id
 
     def get_username(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
-            username = DockChart.objects.get(ship_id=obj.ship_id, end_time=None).port.user.username
-            return username
+        dock_chart = _active_chart(obj.ship)
+        if dock_chart is not None:
+            return dock_chart.port.user.username
 
     def get_user_id(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
-            user_id = DockChart.objects.get(ship_id=obj.ship_id, end_time=None).port.user.id
-            return user_id
+        dock_chart = _active_chart(obj.ship)
+        if dock_chart is not None:
+            return dock_chart.port.user_id
 
     def get_gravatar(self, obj):
-        if DockChart.objects.filter(ship_id=obj.ship_id, end_time=None).exists():
-            email = DockChart.objects.get(ship_id=obj.ship_id, end_time=None).port.user.email
-            return "https://www.gravatar.com/avatar/%s?%s" % (
-                hashlib.md5(email.lower().encode('utf-8')).hexdigest(),
-                urllib.parse.urlencode({'s': str(40), 'd': 'identicon'})
-            )
+        dock_chart = _active_chart(obj.ship)
+        if dock_chart is not None:
+            return gravatar_url(dock_chart.port.user.email)
 
     def get_next_ship_store_id(self, obj):
-        if Ship.objects.filter(pk=obj.ship_id).exists():
-            ship = Ship.objects.get(pk=obj.ship_id)
-            ships = ShipStore.objects.filter(buy_cost__gt=ship.ship_store.buy_cost).order_by('buy_cost')
-            next_shipstore = ships.exclude(ship=ship)
-            if next_shipstore==None:
+        if obj.ship is not None:
+            next_ship_store = get_catalog().next_ship_store(obj.ship.ship_store_id)
+            if next_ship_store is None:
                 return 'This is the last ship'
-            return next_shipstore.first().id
+            return next_ship_store.id
 
     class Meta:
         model = Dock
@@ -219,23 +205,17 @@ class SuggestionListSerializer(serializers.Serializer):
 
     def validate(self, attrs):
         user = self.context['request'].user
-        island = Island.objects.filter(pk=attrs['island_id'])
+        island = get_catalog().islands.by_id.get(attrs['island_id'])
 
-        if island.count() == 0:
+        if island is None:
             raise serializers.ValidationError('Island with the given ID doesn\'t exist')
-        island = island.first()
         if not island.habitable:
             raise serializers.ValidationError('Given island is pirate island')
 
-        users = User.objects.filter(profile__island=island)
-        if user.profile.island.__eq__(island):
-            users = users.exclude(id=user.id)
-
-        if users.count() == 0:
+        users = User.objects.filter(profile__island_id=island.id).exclude(id=user.id)
+        if not users.exists():
             raise serializers.ValidationError('No user exists for the given island')
 
-        attrs['users'] = users
-
         return attrs
 
 
@@ -254,25 +234,26 @@ class UpgradeShipSerializer(serializers.Serializer):
         except Ship.DoesNotExist:
             raise serializers.ValidationError('Ship with the given ID doesn\'t exist')
 
-        if not ship.check_inventory(user):
-            raise serializers.ValidationError('Insufficient items')
-
-        ship_store = Ship.objects.get(pk=ship_id).ship_store
-        if ShipStore.objects.order_by('buy_cost').last() == ship_store:
+        if get_catalog().is_last_ship_store(ship.ship_store_id):
             raise serializers.ValidationError('Ship cannot be upgraded.')
 
+        # Takes the items, so two requests can't spend them twice
+        attrs['next_ship_store'] = ShipUpgrade.objects.consume_inventory(ship, user)
+        if attrs['next_ship_store'] is None:
+            raise serializers.ValidationError('Insufficient items')
+
         return attrs
 
     def update_ship(self):
         user = self.context['request'].user
         ship_id = self.validated_data['ship_id']
         ship = Ship.objects.get(pk=ship_id)
-        next_ship_store = ShipUpgrade.objects.consume_inventory(ship, user)
+        next_ship_store = self.validated_data['next_ship_store']
         next_ship_instance = ship.update(next_ship_store=next_ship_store, user=user)
         Profile.objects.add_exp(user.profile, next_ship_store.experience_gain)
         # Update cumulative ship level
 
-        level_delta = next_ship_instance.ship_store.ship_lvl - ship.ship_store.ship_lvl
+        level_delta = next_ship_store.ship_lvl - get_catalog().ship_stores.by_id[ship.ship_store_id].ship_lvl
         Profile.objects.cumulative_ship_level(user=user, level_delta=level_delta)
 
         Dock.objects.update_ship_docked(ship, next_ship_instance)
@@ -337,22 +318,15 @@ class DockShipSerializer(serializers.Serializer):
         except Ship.DoesNotExist:
             raise serializers.ValidationError('Ship with given ID doesn\'t exist')
 
-        port_id = attrs['port_id']
         try:
-            port_id = Port.objects.get(id=port_id).id
+            port = Port.objects.get(id=attrs['port_id'])
         except Port.DoesNotExist:
             raise serializers.ValidationError('Port does not exist.')
 
-        port = Port.objects.get(id=port_id)
-
-        if port.user == ship.user:
+        if port.user_id == ship.user_id:
             raise serializers.ValidationError('Cant port on own Port')
 
-        # initialize
-        port_unoccupied = False
-        if DockChart.objects.filter(port=port, end_time=None).count() == 0:
-            port_unoccupied = True
-        if not port_unoccupied:
+        if not port.is_idle():
             raise serializers.ValidationError('Port is busy.')
 
         return attrs
@@ -369,7 +343,7 @@ class PortsListSerializer(serializers.ModelSerializer):
     logs = serializers.SerializerMethodField('get_logs_for_port')
 
     def get_logs_for_port(self, obj):
-        docks = DockChart.objects.filter(end_time=None, port=obj)
+        docks = [obj.log] if obj.log_id is not None else []
         serializer = DockChartSerializer(docks, many=True)
         return serializer.data
 
@@ -388,31 +362,31 @@ class ShipsListSerializer(serializers.ModelSerializer):
     ship_image = serializers.SerializerMethodField()
 
     def get_ship_status(self, obj):
-        if DockChart.objects.filter(ship_id=obj, end_time=None).exists():
+        if _active_chart(obj) is not None:
             return "Busy"
         elif obj is None:
             return None
         return "Idle"
 
     def get_island_id(self, obj):
-        if DockChart.objects.filter(ship_id=obj, end_time=None).exists():
-            island_id = DockChart.objects.get(ship_id=obj, end_time=None).port.user.profile.island_id
-            return island_id
+        dock_chart = _active_chart(obj)
+        if dock_chart is not None:
+            return dock_chart.port.user.profile.island_id
 
     def get_park_time(self, obj):
-        if DockChart.objects.filter(ship_id=obj, end_time=None).exists():
-            park_time = DockChart.objects.get(ship_id=obj, end_time=None).start_time
-            return park_time
+        dock_chart = _active_chart(obj)
+        if dock_chart is not None:
+            return dock_chart.start_time
 
     def get_port_id(self, obj):
-        if DockChart.objects.filter(ship_id=obj, end_time=None).exists():
-            port_id = DockChart.objects.get(ship_id=obj, end_time=None).port.id
-            return port_id
+        dock_chart = _active_chart(obj)
+        if dock_chart is not None:
+            return dock_chart.port_id
 
     def get_username(self, obj):
-        if DockChart.objects.filter(ship_id=obj, end_time=None).exists():
-            username = DockChart.objects.get(ship_id=obj, end_time=None).port.user.username
-            return username
+        dock_chart = _active_chart(obj)
+        if dock_chart is not None:
+            return dock_chart.port.user.username
 
     def get_ship_image(self, obj):
         return obj.ship_store.image.url
@@ -449,28 +423,19 @@ class ShipStoreSerializer(serializers.ModelSerializer):
     gold_required = serializers.SerializerMethodField()
 
     def get_bamboo_required(self, obj):
-        bamboo_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=obj.ship_lvl,
-                                                     item_id__name='Bamboo').aggregate(Sum('count'))
-        return bamboo_required['count__sum']
+        return get_catalog().cumulative_cost(obj.ship_lvl).items.get('Bamboo')
 
     def get_banana_required(self, obj):
-        banana_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=obj.ship_lvl,
-                                                     item_id__name='Banana').aggregate(Sum('count'))
-        return banana_required['count__sum']
+        return get_catalog().cumulative_cost(obj.ship_lvl).items.get('Banana')
 
     def get_timber_required(self, obj):
-        timber_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=obj.ship_lvl,
-                                                     item_id__name='Timber').aggregate(Sum('count'))
-        return timber_required['count__sum']
+        return get_catalog().cumulative_cost(obj.ship_lvl).items.get('Timber')
 
     def get_coconut_required(self, obj):
-        coconut_required = ShipUpgrade.objects.filter(ship_store__ship_lvl__lte=obj.ship_lvl,
-                                                      item_id__name='Coconut').aggregate(Sum('count'))
-        return coconut_required['count__sum']
+        return get_catalog().cumulative_cost(obj.ship_lvl).items.get('Coconut')
 
     def get_gold_required(self, obj):
-        gold_required = ShipStore.objects.filter(ship_lvl__lte=obj.ship_lvl).aggregate(Sum('buy_cost'))
-        return gold_required['buy_cost__sum']
+        return get_catalog().cumulative_cost(obj.ship_lvl).gold
 
     class Meta:
         model = ShipStore
@@ -485,21 +450,48 @@ class VersionSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class PlayerDailyStatsSerializer(serializers.ModelSerializer):
+    item = serializers.SerializerMethodField()
+
+    def get_item(self, obj):
+        return get_catalog().items.by_id[obj.item_id].name
+
+    class Meta:
+        model = PlayerDailyStats
+        fields = ('day', 'item', 'earned', 'undockings')
+
+
+class PortDailyStatsSerializer(serializers.ModelSerializer):
+    port_id = serializers.IntegerField()
+
+    class Meta:
+        model = PortDailyStats
+        fields = ('day', 'port_id', 'dockings', 'fines', 'fine_amount')
+
+
+class IslandDailyStatsSerializer(serializers.ModelSerializer):
+    island_id = serializers.IntegerField()
+    island_name = serializers.SerializerMethodField()
+
+    def get_island_name(self, obj):
+        return get_catalog().islands.by_id[obj.island_id].name
+
+    class Meta:
+        model = IslandDailyStats
+        fields = ('day', 'island_id', 'island_name', 'dockings', 'undockings', 'fines')
+
+
 class BuySlotSerializer(serializers.Serializer):
     def validate(self, attrs):
         user = self.context['request'].user
         dock = Dock.objects.filter(ship=None, status='buy').order_by('slot__gold').first()
         if dock is None:
             raise serializers.ValidationError("No buyable slot.")
-        user_gold = Inventory.objects.get(user=user, item__name='Gold').count
-        required_gold = dock.slot.gold
-        if user_gold < required_gold:
+        if not Dock.objects.pay_for_slot(dock, user):
             raise serializers.ValidationError('Insufficient gold.')
         attrs['dock'] = dock
 
         return attrs
 
     def save(self, **kwargs):
-        Dock.objects.buy_slot(
-            self.validated_data['dock'], self.context['request'].user
-        )
+        Dock.objects.buy_slot(self.validated_data['dock'])
@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save
+
+from core import catalog
+from core.models import Dock, Island, Item, Level, PortType, ShipStore, ShipUpgrade, Slot, Version
+
+# Version is not part of the catalog, but its responses are cached under the catalog version
+CATALOG_MODELS = (Island, Item, Level, PortType, ShipStore, ShipUpgrade, Slot, Version)
+
+
+def invalidate_catalog(sender, **kwargs):
+    catalog.invalidate()
+
+
+def unlock_reached_slots(sender, raw=False, **kwargs):
+    # Players only unlock slots as they gain experience, so a lower requirement has to reach everyone.
+    # Fixtures are loaded a row at a time, the catalog may not be complete until they are done.
+    if not raw:
+        Dock.objects.unlock_slots()
+
+
+for model in CATALOG_MODELS:
+    post_save.connect(invalidate_catalog, sender=model, dispatch_uid='catalog-save-' + model.__name__)
+    post_delete.connect(invalidate_catalog, sender=model, dispatch_uid='catalog-delete-' + model.__name__)
+
+for model in (Level, Slot):
+    post_save.connect(unlock_reached_slots, sender=model, dispatch_uid='unlock-slots-save-' + model.__name__)
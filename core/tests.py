@@ -1,11 +1,19 @@
+import gzip
+from io import StringIO
+
 from django.contrib.auth.models import User
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.db.models import Sum
-from core.models import Dock, ShipStore, Port, PortType, Ship, DockChart, ShipUpgrade
+from core import caching, catalog, metrics, rollups
+from core.catalog import get_catalog
+from core.models import Dock, ShipStore, Port, PortType, Ship, DockChart, ShipUpgrade, FineLog, ArchivedDockChart, \
+    ArchivedFineLog, PortDailyStats, PlayerDailyStats, IslandDailyStats
 from player.models import Profile, Inventory, Item
 
 
@@ -14,6 +22,15 @@ def setUpModule():
     call_command('loaddata', 'db.json', verbosity=0)
 
 
+def run_commit_hooks():
+    """
+    Runs the on_commit callbacks of the test case's transaction, which is never committed
+    """
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for _, callback in callbacks:
+        callback()
+
+
 class DockPirateIslandTests(APITestCase):
     url = reverse('pirate-island')
 
@@ -128,6 +145,24 @@ class DockPirateIslandTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(dock_chart.ship.ship_store.name, ship.ship_store.name)
 
+    def test_allocates_idle_ports(self):
+        """Ensure every pirate port takes one ship at a time"""
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        pirate_type = PortType.objects.get(ownable=False)
+        ports = [Port.objects.create(user=user, type=pirate_type) for _ in range(2)]
+        ships = [Ship.objects.create(user=user, ship_store=ShipStore.objects.first()) for _ in range(3)]
+
+        first = DockChart.objects.allocate_pirate_port(ships[0])
+        second = DockChart.objects.allocate_pirate_port(ships[1])
+        self.assertEqual({first.port_id, second.port_id}, {port.id for port in ports})
+        self.assertIsNone(DockChart.objects.allocate_pirate_port(ships[2]))
+        self.assertFalse(DockChart.objects.is_available())
+
+        DockChart.objects.undock_ship(ships[0])
+        self.assertEqual(DockChart.objects.allocate_pirate_port(ships[2]).port_id, first.port_id)
+
 
 class UpgradeShipTests(APITestCase):
     url = reverse('upgrade-ship')
@@ -451,6 +486,34 @@ class CorePortTest(APITestCase):
         self.assertEqual(response.data[0]['logs'][0]['username'], user2.username)
         self.assertEqual(response.data[0]['logs'][0]['user_id'], user2.id)
 
+    def test_constant_queries(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+
+        user2 = User.objects.create_user(username='some_username2', password='some_password',
+                                         email='some_email2@gmail.com')
+        Profile.objects.create_player(username='some_username2')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user2.auth_token.key))
+        self.url = reverse('ports', kwargs={'user_id': user.id})
+        ports = Port.objects.filter(user=user).order_by('id')
+
+        DockChart.objects.create(ship=Ship.objects.get(user=user2), port=ports[0])
+        with CaptureQueriesContext(connection) as one_docked:
+            self.client.get(self.url)
+
+        for port in ports[1:]:
+            ship = Ship.objects.create(user=user2, ship_store=ShipStore.objects.get(ship_lvl=0))
+            DockChart.objects.create(ship=ship, port=port)
+        with CaptureQueriesContext(connection) as all_docked:
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(one_docked), len(all_docked))
+        for port in response.data:
+            self.assertEqual(len(port['logs']), 1)
+            self.assertEqual(port['logs'][0]['username'], user2.username)
+            self.assertEqual(port['logs'][0]['user_id'], user2.id)
+
     def test_port_others(self):
         # Test details of other's ports
         dock_url = reverse('dock-ship')
@@ -478,7 +541,7 @@ class CorePortTest(APITestCase):
         self.assertEqual(response.data[0]['logs'][0]['user_id'], user2.id)
 
 
-class ShipsListViewTest(APITestCase):
+class UserShipsListViewTest(APITestCase):
     url = reverse('player:ships')
 
     def test_port_details(self):
@@ -511,10 +574,77 @@ class ShipsListViewTest(APITestCase):
         self.assertEqual(response.data[0]['port_id'], port_id)
         self.assertEqual(response.data[0]['username'], username)
 
+    def test_constant_queries(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+
+        user2 = User.objects.create_user(username='some_username2', password='some_password',
+                                         email='some_email2@gmail.com')
+        Profile.objects.create_player(username='some_username2')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        with CaptureQueriesContext(connection) as one_ship:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 1)
+
+        for port in Port.objects.filter(user=user2).order_by('id')[:3]:
+            ship = Ship.objects.create(user=user, ship_store=ShipStore.objects.get(ship_lvl=2))
+            DockChart.objects.create(ship=ship, port=port)
+
+        with CaptureQueriesContext(connection) as many_ships:
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 4)
+
+        self.assertEqual(len(one_ship), len(many_ships))
+        self.assertEqual(response.data[1]['status'], 'Busy')
+        self.assertEqual(response.data[1]['username'], user2.username)
+        self.assertEqual(response.data[1]['island_id'], user2.profile.island_id)
+
 
 class UndockShipTest(APITestCase):
     url = reverse('undock')
 
+    def tearDown(self):
+        # Changes made by a test are rolled back without sending signals
+        catalog.invalidate()
+
+    def test_late_undock_stops_at_expiry(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        user2 = User.objects.create_user(username='some_username2', password='some_password')
+        Profile.objects.create_player(username='some_username2')
+        ship = Ship.objects.get(user=user2)
+        port = Port.objects.filter(user=user, type__penalizable=False).first()
+
+        dock_chart = DockChart.objects.create_entry(ship.id, port.id)
+        dock_chart.start_time -= timezone.timedelta(minutes=40)
+        dock_chart.save()
+
+        dock_chart = DockChart.objects.undock_ship(ship)
+        self.assertEqual(dock_chart.end_time, dock_chart.expires_at)
+
+    def test_fractional_payout_matches_settlement(self):
+        owner = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        users = []
+        for username in ('some_username2', 'some_username3'):
+            users.append(User.objects.create_user(username=username, password='some_password'))
+            Profile.objects.create_player(username=username)
+        ships = [Ship.objects.get(user=user) for user in users]
+        ShipStore.objects.filter(pk=ships[0].ship_store_id).update(cost_multiplier=1.39)
+        ports = Port.objects.filter(user=owner, type__penalizable=False)[:2]
+        item = owner.profile.island.item
+
+        undocked = DockChart.objects.create_entry(ships[0].id, ports[0].id)
+        DockChart.objects.undock_ship(ships[0], end_time=undocked.start_time + timezone.timedelta(minutes=30))
+        settled = DockChart.objects.create_entry(ships[1].id, ports[1].id)
+        DockChart.objects.settle([settled.id], now=settled.expires_at)
+
+        # 30 minutes at 1.39 is 41.7, which both paths truncate
+        for user in users:
+            self.assertEqual(Inventory.objects.get(user=user, item=item).count, 41)
+
     def test_undock(self):
         dock_url = reverse('dock-ship')
         user = User.objects.create_user(username='some_username', password='some_password',
@@ -534,6 +664,25 @@ class UndockShipTest(APITestCase):
         response = self.client.post(self.url, data)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    def test_docking_pointers(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        user2 = User.objects.create_user(username='some_username2', password='some_password',
+                                         email='some_email2@gmail.com')
+        Profile.objects.create_player(username='some_username2')
+        ship = Ship.objects.get(user=user2)
+        port = Port.objects.filter(user=user, type__penalizable=False).first()
+
+        dock_chart = DockChart.objects.create_entry(ship.id, port.id)
+        self.assertEqual(Ship.objects.get(pk=ship.id).log_id, dock_chart.id)
+        self.assertEqual(Port.objects.get(pk=port.id).log_id, dock_chart.id)
+        self.assertFalse(Port.objects.get(pk=port.id).is_idle())
+
+        DockChart.objects.undock_ship(ship)
+        self.assertTrue(Ship.objects.get(pk=ship.id).is_idle())
+        self.assertTrue(Port.objects.get(pk=port.id).is_idle())
+
     def test_auto_undock(self):
         dock_url = reverse('dock-ship')
         user = User.objects.create_user(username='some_username', password='some_password',
@@ -556,12 +705,79 @@ class UndockShipTest(APITestCase):
         dock.save()
         dock.refresh_from_db()
 
+        call_command('settle_dockings', once=True)
+
         ships_url = reverse('player:ships')
         response = self.client.get(ships_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data[0]['status'], "Idle")
         self.assertEqual(response.data[0]['name'], "Raft")
 
+    def test_settle_at_expiry(self):
+        dock_url = reverse('dock-ship')
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+
+        user2 = User.objects.create_user(username='some_username2', password='some_password',
+                                         email='some_email2@gmail.com')
+        Profile.objects.create_player(username='some_username2')
+        ship_id = Ship.objects.get(user=user2).id
+        port_id = Port.objects.filter(user=user, type__penalizable=False).first().id
+        # Parking user2's raft on user's port
+        data = {'ship_id': ship_id, 'port_id': port_id}
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user2.auth_token.key))
+        self.client.post(dock_url, data)
+
+        dock = DockChart.objects.get(ship_id=ship_id, end_time=None)
+        dock.start_time -= timezone.timedelta(minutes=40)
+        dock.save()
+
+        # Reads no longer undock timed out ships
+        self.client.get(reverse('player:ships'))
+        self.assertTrue(DockChart.objects.filter(ship_id=ship_id, end_time=None).exists())
+
+        call_command('settle_dockings', once=True)
+
+        dock.refresh_from_db()
+        self.assertTrue(dock.is_success)
+        self.assertEqual(dock.end_time, dock.expires_at)
+        self.assertEqual(dock.end_time - dock.start_time, timezone.timedelta(minutes=30))
+        item = user.profile.island.item
+        # A raft earns one item per minute docked
+        self.assertEqual(Inventory.objects.get(user=user2, item=item).count, 30)
+
+    def test_bulk_settle_queries(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+
+        user2 = User.objects.create_user(username='some_username2', password='some_password',
+                                         email='some_email2@gmail.com')
+        Profile.objects.create_player(username='some_username2')
+        raft = ShipStore.objects.get(ship_lvl=0)
+        start_time = timezone.now() - timezone.timedelta(minutes=40)
+
+        def dock_ships(count):
+            for port in Port.objects.filter(user=user)[:count]:
+                ship = Ship.objects.create(user=user2, ship_store=raft)
+                DockChart.objects.create(ship=ship, port=port, start_time=start_time)
+
+        dock_ships(1)
+        with CaptureQueriesContext(connection) as single:
+            self.assertEqual(DockChart.objects.settle_expired(user_id=user2.id), 1)
+
+        dock_ships(3)
+        with CaptureQueriesContext(connection) as several:
+            self.assertEqual(DockChart.objects.settle_expired(user_id=user2.id), 3)
+
+        self.assertEqual(len(single), len(several))
+        self.assertFalse(DockChart.objects.filter(end_time=None).exists())
+        item = user.profile.island.item
+        self.assertEqual(Inventory.objects.get(user=user2, item=item).count, 4 * 30)
+        user2.profile.refresh_from_db()
+        self.assertEqual(user2.profile.experience, 10 + 4 * 50)
+
 
 class DockListViewTest(APITestCase):
     url = reverse('docks')
@@ -615,6 +831,72 @@ class DockListViewTest(APITestCase):
             else:
                 self.assertEqual(dock['ship_status'], 'Idle')
 
+    def test_constant_queries(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+
+        user2 = User.objects.create_user(username='some_username2', password='some_password',
+                                         email='some_email2@gmail.com')
+        Profile.objects.create_player(username='some_username2')
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        Profile.objects.add_exp(user.profile, 10000000)
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as few_ships:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Fill the remaining docks and park some of the ships on user2's ports
+        ports = Port.objects.filter(user=user2).order_by('id')
+        for dock, port in zip(Dock.objects.filter(user=user, ship=None).order_by('id'), ports):
+            dock.ship = Ship.objects.create(user=user, ship_store=ShipStore.objects.get(ship_lvl=1))
+            dock.save()
+            DockChart.objects.create(ship=dock.ship, port=port)
+
+        with CaptureQueriesContext(connection) as many_ships:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(len(few_ships), len(many_ships))
+        self.assertEqual(response.data[1]['ship_status'], 'Busy')
+        self.assertEqual(response.data[1]['username'], user2.username)
+        self.assertEqual(response.data[1]['island_id'], user2.profile.island_id)
+
+
+class UnlockSlotsTests(APITestCase):
+    def tearDown(self):
+        # Changes made by a test are rolled back without sending signals
+        catalog.invalidate()
+
+    def test_unlocked_by_experience(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.assertFalse(Dock.objects.filter(user=user, status='buy').exists())
+
+        Profile.objects.add_exp(user.profile, 10000000)
+        self.assertFalse(Dock.objects.filter(user=user, status='locked').exists())
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('docks'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+
+    def test_unlocked_by_lower_requirement(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        dock = Dock.objects.filter(user=user, status='locked').select_related('slot__unlock_level').first()
+
+        level = dock.slot.unlock_level
+        level.experience_required = 0
+        level.save()
+        dock.refresh_from_db()
+        self.assertEqual(dock.status, 'buy')
+
 
 class BuySlotViewTest(APITestCase):
     url = reverse('buy-slot')
@@ -664,10 +946,26 @@ class BuySlotViewTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(initial_gold - final_gold, required_gold)
 
+    def test_raft_without_gold(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        Inventory.objects.filter(user=user, item__name='Gold').update(count=0)
+        ships = Ship.objects.filter(user=user).count()
+        dock = Dock.objects.filter(user=user, ship=None).first()
+
+        self.assertIsNone(dock.allocate_raft())
+        dock.refresh_from_db()
+        self.assertIsNone(dock.ship_id)
+        self.assertEqual(Ship.objects.filter(user=user).count(), ships)
+
 
 class ShipsListViewTest(APITestCase):
     url = reverse('ship-list')
 
+    def setUp(self):
+        # Renders the responses instead of serving those of earlier tests
+        caching.clear()
+
     def test_required_inventory(self):
         user = User.objects.create_user(username='some_username', password='some_password',
                                         email='some_email@gmail.com')
@@ -697,3 +995,288 @@ class ShipsListViewTest(APITestCase):
             self.assertEqual(response.data[index]['gold_required'], gold_required['buy_cost__sum'])
 
             index += 1
+
+    def test_constant_queries(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        ship_store = ShipStore.objects.order_by('ship_lvl').last()
+
+        get_catalog()
+        with CaptureQueriesContext(connection) as detail_queries:
+            detail = self.client.get(reverse('ship-detail', kwargs={'ship_id': ship_store.id}))
+        with CaptureQueriesContext(connection) as list_queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(list_queries), len(detail_queries))
+        self.assertEqual(response.data[-1], detail.data)
+
+
+class CatalogTests(APITestCase):
+    def tearDown(self):
+        # Changes made by a test are rolled back without sending signals
+        catalog.invalidate()
+
+    def test_cached(self):
+        get_catalog()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_catalog().item('Gold').name, 'Gold')
+            self.assertEqual(get_catalog().raft.buy_cost, 0)
+            self.assertFalse(get_catalog().islands.by_name['Pirate Island'].habitable)
+
+    def test_invalidated_on_save(self):
+        self.assertEqual(get_catalog().raft.name, 'Raft')
+
+        raft = ShipStore.objects.get(ship_lvl=0)
+        raft.name = 'Dinghy'
+        raft.save()
+
+        self.assertEqual(get_catalog().raft.name, 'Dinghy')
+
+    def test_reloaded_on_bump_by_another_worker(self):
+        loaded = get_catalog()
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE core_catalogversion SET version = version + 1 WHERE id = 1")
+        # Still trusted until the next check
+        self.assertIs(get_catalog(), loaded)
+
+        catalog._checked_at = 0
+        reloaded = get_catalog()
+        self.assertIsNot(reloaded, loaded)
+        self.assertEqual(reloaded.version, loaded.version + 1)
+
+
+class CatalogCachingTests(APITestCase):
+    url = reverse('ship-list')
+
+    def setUp(self):
+        caching.clear()
+
+    def test_not_modified(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # An admin's change committed by another worker, seen once this worker checks the version again
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE core_catalogversion SET version = version + 1 WHERE id = 1")
+        catalog._checked_at = 0
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_serves_rendered_bytes(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        rendered = self.client.get(self.url, HTTP_ACCEPT='application/json').content
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.content, rendered)
+        self.assertFalse([query for query in queries if 'core_shipstore' in query['sql']])
+
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), rendered)
+
+    def test_keyed_by_renderer(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        rendered = self.client.get(self.url, {'format': 'json'})
+        self.assertTrue(rendered['Content-Type'].startswith('application/json'))
+
+        response = self.client.get(self.url, {'format': 'api'})
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        response = self.client.get(self.url, {'format': 'json'})
+        self.assertEqual(response.content, rendered.content)
+
+
+class GenerateWorldTests(APITestCase):
+    def _world(self, prefix):
+        call_command('generate_world', players=20, chunk_size=7, seed=1, prefix=prefix, docked=0.5,
+                     stdout=StringIO())
+        profiles = Profile.objects.filter(user__username__startswith=prefix).order_by('user_id')
+        charts = DockChart.objects.filter(ship__user__username__startswith=prefix, end_time=None)
+        return list(profiles.values_list('island_id', 'experience')), charts
+
+    def test_deterministic_world(self):
+        first_world, first_charts = self._world('first')
+        second_world, second_charts = self._world('second')
+
+        self.assertEqual(len(first_world), 20)
+        self.assertEqual(first_world, second_world)
+        self.assertEqual(first_charts.count(), second_charts.count())
+        for chart in first_charts:
+            self.assertEqual(Port.objects.get(pk=chart.port_id).log_id, chart.id)
+            self.assertNotEqual(chart.port.user_id, chart.ship.user_id)
+
+
+class ArchiveHistoryTests(APITestCase):
+    def test_moves_closed_charts(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        user2 = User.objects.create_user(username='some_username2', password='some_password')
+        Profile.objects.create_player(username='some_username2')
+        ship = Ship.objects.get(user=user2)
+        port = Port.objects.filter(user=user, type__penalizable=True).first()
+
+        start_time = timezone.now() - timezone.timedelta(days=40)
+        closed = DockChart.objects.create(ship=ship, port=port, start_time=start_time,
+                                          end_time=start_time + timezone.timedelta(minutes=5))
+        FineLog.objects.create_log(20, closed)
+        open_chart = DockChart.objects.create(ship=ship, port=port)
+
+        call_command('archive_history', days=30, stdout=StringIO())
+        self.assertEqual(list(DockChart.objects.filter(ship=ship)), [open_chart])
+        archived = ArchivedDockChart.objects.get(pk=closed.id)
+        self.assertEqual(archived.fines.get().amount, 20)
+        self.assertFalse(FineLog.objects.filter(dock_chart_id=closed.id).exists())
+
+        call_command('archive_history', days=30, purge_days=35, stdout=StringIO())
+        self.assertFalse(ArchivedDockChart.objects.exists())
+        self.assertFalse(ArchivedFineLog.objects.exists())
+
+
+class RollupTests(APITestCase):
+    url = reverse('stats')
+
+    def test_daily_stats(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        user2 = User.objects.create_user(username='some_username2', password='some_password')
+        Profile.objects.create_player(username='some_username2')
+        ship = Ship.objects.get(user=user2)
+        parking = Port.objects.filter(user=user, type__penalizable=False).first()
+        non_parking = Port.objects.filter(user=user, type__penalizable=True).first()
+
+        dock_chart = DockChart.objects.create_entry(ship.id, parking.id)
+        DockChart.objects.undock_ship(ship, end_time=dock_chart.start_time + timezone.timedelta(minutes=30))
+        dock_chart = DockChart.objects.create_entry(ship.id, non_parking.id)
+        FineLog.objects.create_log(20, DockChart.objects.end_parking(Port.objects.get(pk=non_parking.id)))
+        # Written once the transaction commits
+        self.assertFalse(PortDailyStats.objects.exists())
+        run_commit_hooks()
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum(row['dockings'] for row in response.data['ports']), 2)
+        self.assertEqual(sum(row['fine_amount'] for row in response.data['ports']), 20)
+        island = [row for row in response.data['islands'] if row['island_id'] == user.profile.island_id][0]
+        self.assertEqual((island['dockings'], island['undockings'], island['fines']), (2, 1, 1))
+
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user2.auth_token.key))
+        earnings = self.client.get(self.url).data['earnings']
+        self.assertEqual(len(earnings), 1)
+        self.assertEqual(earnings[0]['item'], user.profile.island.item.name)
+        self.assertEqual(earnings[0]['undockings'], 1)
+
+
+    def test_rebuild_matches_live_counters(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        user2 = User.objects.create_user(username='some_username2', password='some_password')
+        Profile.objects.create_player(username='some_username2')
+        ship = Ship.objects.get(user=user2)
+        parking = Port.objects.filter(user=user, type__penalizable=False).first()
+        non_parking = Port.objects.filter(user=user, type__penalizable=True).first()
+
+        DockChart.objects.create_entry(ship.id, parking.id)
+        DockChart.objects.undock_ship(ship)
+        DockChart.objects.create_entry(ship.id, non_parking.id)
+        FineLog.objects.create_log(20, DockChart.objects.end_parking(Port.objects.get(pk=non_parking.id)))
+        run_commit_hooks()
+
+        def rows():
+            return [sorted(model.objects.values_list(*fields)) for model, fields in (
+                (PlayerDailyStats, ('day', 'user_id', 'item_id', 'earned', 'undockings')),
+                (PortDailyStats, ('day', 'port_id', 'dockings', 'fines', 'fine_amount')),
+                (IslandDailyStats, ('day', 'island_id', 'dockings', 'undockings', 'fines')),
+            )]
+
+        live = rows()
+        PortDailyStats.objects.all().delete()
+        call_command('rebuild_rollups', date=rollups.today().isoformat(), stdout=StringIO())
+        self.assertEqual(rows(), live)
+
+
+class ExplainHotQueriesTests(APITestCase):
+    def test_prints_plans(self):
+        out = StringIO()
+        call_command('explain_hot_queries', generate=10, stdout=out)
+
+        self.assertIn('open chart of a ship', out.getvalue())
+        self.assertIn('idle pirate port', out.getvalue())
+
+
+class MetricsTests(APITestCase):
+    url = reverse('metrics')
+
+    def tearDown(self):
+        metrics.reset()
+
+    def test_admin_only(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_records_views(self):
+        user = User.objects.create_superuser(username='some_username', password='some_password',
+                                             email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        self.client.get(reverse('ship-list'))
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = response.content.decode()
+        self.assertIn('directme_sql_queries_count{view="ShipsList"} 1', body)
+        self.assertIn('directme_serializer_duration_seconds_count{view="ShipsList"} 1', body)
+
+    def test_counts_queries_without_debug_cursor(self):
+        user = User.objects.create_superuser(username='some_username', password='some_password',
+                                             email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        self.client.get(reverse('docks'))
+        self.assertFalse(connection.force_debug_cursor)
+        body = self.client.get(self.url).content.decode()
+
+        line = [line for line in body.splitlines() if line.startswith('directme_sql_queries_sum{view="DocksListView"}')]
+        self.assertGreater(float(line[0].split()[-1]), 0)
+
+    def test_times_serializers(self):
+        user = User.objects.create_superuser(username='some_username', password='some_password',
+                                             email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        self.client.get(reverse('docks'))
+        body = self.client.get(self.url).content.decode()
+
+        def total(name):
+            prefix = 'directme_{}_sum{{view="DocksListView"}}'.format(name)
+            return float([line for line in body.splitlines() if line.startswith(prefix)][0].split()[-1])
+
+        self.assertGreater(total('serializer_duration_seconds'), 0)
+        self.assertLessEqual(total('serializer_duration_seconds'), total('request_duration_seconds'))
@@ -16,4 +16,6 @@ urlpatterns = [
     url(r'^pirate-island/$', views.DockPirateIsland.as_view(), name='pirate-island'),
     url(r'^buy-ship/$', views.BuyShipView.as_view(), name='buy-ship'),
     url(r'^buy-slot/$', views.BuySlotView.as_view(), name='buy-slot'),
+    url(r'^stats/$', views.StatsView.as_view(), name='stats'),
+    url(r'^metrics/$', views.MetricsView.as_view(), name='metrics'),
 ]
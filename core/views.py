@@ -1,14 +1,19 @@
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404, get_list_or_404
+from django.utils import timezone
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from core.models import ShipStore, Version, Dock, Ship, Port, DockChart
+from core import metrics, rollups
+from core.caching import catalog_cached
+from core.models import ShipStore, Version, Dock, Ship, Port, PlayerDailyStats, PortDailyStats, IslandDailyStats
 from core.serializers import ShipStoreSerializer, VersionSerializer, DocksListSerializer, DockShipSerializer, \
     DockPirateIslandSerializer, PortsListSerializer, ShipsListSerializer, FineSerializer, UndockSerializer, \
-    UpgradeShipSerializer, BuyShipSerializer, BuySlotSerializer
+    UpgradeShipSerializer, BuyShipSerializer, BuySlotSerializer, PlayerDailyStatsSerializer, PortDailyStatsSerializer, \
+    IslandDailyStatsSerializer
+from player.authentication import CachedTokenAuthentication
 
 
 class BuyShipView(APIView):
@@ -16,7 +21,7 @@ class BuyShipView(APIView):
     Buy a new ship
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = BuyShipSerializer
 
@@ -33,15 +38,13 @@ class DocksListView(APIView):
     Retrieves docks for the user.
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = DocksListSerializer
 
     def get(self, request):
-        Dock.objects.check_exp(request.user)
-        DockChart.objects.undock_timedout(user_id=request.user.id)
-        ships = get_list_or_404(Dock.objects.order_by('id'), user_id=request.user.id)
-        serializer = self.serializer_class(ships, many=True)
+        docks = get_list_or_404(Dock.objects.listing(request.user.id))
+        serializer = self.serializer_class(docks, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
@@ -50,7 +53,7 @@ class DockShipView(APIView):
     Dock Ship on someone else's port
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = DockShipSerializer
 
@@ -67,15 +70,14 @@ class PortsListView(APIView):
     Retrieve all ports for a user and show if any ship is docked on them or not.
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = PortsListSerializer
 
     def get(self, request, user_id=None):
         if not user_id:
             user_id = request.user.id
-        DockChart.objects.undock_timedout(user_id=user_id)
-        ports = get_list_or_404(Port, user_id=user_id)
+        ports = get_list_or_404(Port.objects.listing(user_id))
         serializer = self.serializer_class(ports, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -85,13 +87,12 @@ class ShipsListView(APIView):
     Retrieves all active ships of a user.
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = ShipsListSerializer
 
     def get(self, request):
-        DockChart.objects.undock_timedout(request.user.id)
-        ships = get_list_or_404(Ship, user_id=request.user.id, is_active=True)
+        ships = get_list_or_404(Ship.objects.listing(request.user.id))
         serializer = self.serializer_class(ships, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -100,10 +101,11 @@ class ShipsList(APIView):
     """
     Lists all ships along with complete details from the store.
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = ShipStoreSerializer
 
+    @catalog_cached
     def get(self, request):
         ships = ShipStore.objects.all().order_by('ship_lvl')
         serializer = self.serializer_class(ships, many=True)
@@ -114,10 +116,11 @@ class ShipsDetail(APIView):
     """
         Retrieves details of a ship along with complete details from the store.
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = ShipStoreSerializer
 
+    @catalog_cached
     def get(self, request, ship_id):
         ship = get_object_or_404(ShipStore, pk=ship_id)
         serializer = self.serializer_class(ship)
@@ -131,6 +134,7 @@ class VersionCheck(APIView):
 
     serializer_class = VersionSerializer
 
+    @catalog_cached
     def get(self, request):
         serializer = self.serializer_class(Version.objects.all(), many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
@@ -140,7 +144,7 @@ class FineView(APIView):
     """
     Fine a ship on your non-parking port
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = FineSerializer
 
@@ -157,7 +161,7 @@ class UndockShipView(APIView):
     Undock Ship from someone else's port
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = UndockSerializer
 
@@ -174,7 +178,7 @@ class UpdateShipView(APIView):
     Update user's ship
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = UpgradeShipSerializer
 
@@ -191,7 +195,7 @@ class DockPirateIsland(APIView):
     Dock a ship at pirate island
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = DockPirateIslandSerializer
 
@@ -208,7 +212,7 @@ class BuySlotView(APIView):
     Buy a slot
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = BuySlotSerializer
 
@@ -218,3 +222,38 @@ class BuySlotView(APIView):
             serializer.save()
             return Response(status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class StatsView(APIView):
+    """
+    Daily earnings of the user, dockings and fines at the user's ports and activity on every island
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    max_days = 90
+
+    def get(self, request):
+        try:
+            days = min(max(int(request.query_params.get('days', 7)), 1), self.max_days)
+        except ValueError:
+            return Response({'days': 'A number of days is required.'}, status=status.HTTP_400_BAD_REQUEST)
+        since = rollups.today() - timezone.timedelta(days=days - 1)
+
+        earnings = PlayerDailyStats.objects.filter(user_id=request.user.id, day__gte=since).order_by('day', 'item_id')
+        ports = PortDailyStats.objects.filter(port__user_id=request.user.id, day__gte=since).order_by('day', 'port_id')
+        islands = IslandDailyStats.objects.filter(day__gte=since).order_by('day', 'island_id')
+        return Response({
+            'earnings': PlayerDailyStatsSerializer(earnings, many=True).data,
+            'ports': PortDailyStatsSerializer(ports, many=True).data,
+            'islands': IslandDailyStatsSerializer(islands, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    Request metrics of this worker in the Prometheus text format
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
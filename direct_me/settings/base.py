@@ -29,6 +29,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE_CLASSES = [
     'opbeat.contrib.django.middleware.OpbeatAPMMiddleware',
+    'core.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -41,6 +42,10 @@ MIDDLEWARE_CLASSES = [
     'direct_me.disable.DisableCSRF',
 ]
 
+# Requests running more queries or taking longer (in seconds) than these are logged by core.metrics
+METRICS_QUERY_BUDGET = None
+METRICS_LATENCY_BUDGET = None
+
 ROOT_URLCONF = 'direct_me.urls'
 
 TEMPLATES = [
@@ -97,10 +102,21 @@ AUTH_PASSWORD_VALIDATORS = [
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication'
+        'player.authentication.CachedTokenAuthentication'
     )
 }
 
+# Seconds a worker trusts a cached auth token, and the cache shared by the workers if any
+TOKEN_CACHE_TTL = 60
+TOKEN_CACHE = None
+
+# Seconds between the writes of the buffered Profile.last_seen updates of a worker
+LAST_SEEN_FLUSH_INTERVAL = 60
+
+# Days after which archive_history moves closed dock charts to the archive, and deletes archived ones (None keeps them)
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_PURGE_AFTER_DAYS = None
+
 LANGUAGE_CODE = 'en-us'
 
 TIME_ZONE = 'Asia/Kolkata'
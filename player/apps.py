@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PlayerConfig(AppConfig):
     name = 'player'
+
+    def ready(self):
+        import player.signals  # noqa
@@ -0,0 +1,113 @@
+"""
+Token authentication with the token and its user cached per worker
+
+Authenticated tokens, with their user and the id of the user's profile, are kept in a bounded LRU for TOKEN_CACHE_TTL seconds, and in the shared cache named
+by TOKEN_CACHE when it is set. Saving a user, which covers password resets and deactivation, or deleting
+a token drops them from this worker and the shared cache at once. Other workers drop them within the TTL.
+"""
+import pickle
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+KEY_PREFIX = 'player:token:profile:'
+# Tokens kept per worker, the least recently used one is dropped past this
+MAX_ENTRIES = 10000
+
+_tokens = OrderedDict()
+_lock = Lock()
+
+
+def _ttl():
+    return getattr(settings, 'TOKEN_CACHE_TTL', 60)
+
+
+def _shared_cache():
+    alias = getattr(settings, 'TOKEN_CACHE', None)
+    if alias is None:
+        return None
+    return caches[alias]
+
+
+def _get(key):
+    """
+    Pickled (user, token, profile id) of the key, None if it isn't cached
+    """
+    now = time.time()
+    with _lock:
+        entry = _tokens.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                _tokens.move_to_end(key)
+                return entry[1]
+            del _tokens[key]
+
+    shared = _shared_cache()
+    if shared is None:
+        return None
+    data = shared.get(KEY_PREFIX + key)
+    if data is not None:
+        _put_local(key, data)
+    return data
+
+
+def _put_local(key, data):
+    with _lock:
+        _tokens[key] = (time.time() + _ttl(), data)
+        _tokens.move_to_end(key)
+        while len(_tokens) > MAX_ENTRIES:
+            _tokens.popitem(last=False)
+
+
+def _put(key, data):
+    _put_local(key, data)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.set(KEY_PREFIX + key, data, _ttl())
+
+
+def forget(key):
+    """
+    Stops authenticating the token from the cache
+    """
+    with _lock:
+        _tokens.pop(key, None)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(KEY_PREFIX + key)
+
+
+def forget_user(user_id):
+    for key in Token.objects.filter(user_id=user_id).values_list('key', flat=True):
+        forget(key)
+
+
+def clear():
+    with _lock:
+        _tokens.clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication which looks the token up in the cache before the database.
+    The user gets a profile_id attribute, so views needing only the id don't load the profile.
+    """
+
+    def authenticate_credentials(self, key):
+        data = _get(key)
+        if data is None:
+            user, token = super(CachedTokenAuthentication, self).authenticate_credentials(key)
+            from player.models import Profile
+            profile_id = Profile.objects.filter(user_id=user.id).values_list('id', flat=True).first()
+            # Inactive users raise above, so they are never cached
+            _put(key, pickle.dumps((user, token, profile_id), pickle.HIGHEST_PROTOCOL))
+        else:
+            # Every request gets its own copies, which views are free to change
+            user, token, profile_id = pickle.loads(data)
+        user.profile_id = profile_id
+        return user, token
@@ -0,0 +1,62 @@
+"""
+Ranks of the players by points, kept in Profile.rank
+
+A player's rank is one more than the number of players with more points, the same as
+RANK() OVER (ORDER BY points DESC). Saving a profile only shifts the ranks of the players whose
+points lie between its old and new points; `rebuild` recomputes every rank in one statement.
+"""
+from django.db import connection
+
+
+def moved(profile_id, old_points, new_points):
+    """
+    Updates the ranks after a player moved from `old_points` (None for a new player) to `new_points`
+    and returns the new rank of the player
+    """
+    with connection.cursor() as cursor:
+        if old_points is None:
+            cursor.execute('UPDATE player_profile SET rank = rank + 1 WHERE points < %s AND id <> %s',
+                           [new_points, profile_id])
+        elif new_points > old_points:
+            cursor.execute('UPDATE player_profile SET rank = rank + 1 '
+                           'WHERE points >= %s AND points < %s AND id <> %s',
+                           [old_points, new_points, profile_id])
+        elif new_points < old_points:
+            cursor.execute('UPDATE player_profile SET rank = rank - 1 '
+                           'WHERE points >= %s AND points < %s AND id <> %s',
+                           [new_points, old_points, profile_id])
+
+        cursor.execute('UPDATE player_profile SET rank = 1 + '
+                       '(SELECT COUNT(*) FROM player_profile WHERE points > %s) '
+                       'WHERE id = %s RETURNING rank',
+                       [new_points, profile_id])
+        return cursor.fetchone()[0]
+
+
+def added(count, points):
+    """
+    Makes room for `count` new players with `points` and returns the rank they share
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE player_profile SET rank = rank + %s WHERE points < %s', [count, points])
+        cursor.execute('SELECT 1 + COUNT(*) FROM player_profile WHERE points > %s', [points])
+        return cursor.fetchone()[0]
+
+
+def removed(points):
+    """
+    Updates the ranks after a player with `points` has been deleted
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE player_profile SET rank = rank - 1 WHERE points < %s', [points])
+
+
+def rebuild():
+    """
+    Recomputes the rank of every player, returns the number of ranks which had drifted
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE player_profile SET rank = ranked.rank '
+                       'FROM (SELECT id, RANK() OVER (ORDER BY points DESC) AS rank FROM player_profile) AS ranked '
+                       'WHERE player_profile.id = ranked.id AND player_profile.rank <> ranked.rank')
+        return cursor.rowcount
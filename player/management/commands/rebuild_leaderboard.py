@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from player import leaderboard
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the leaderboard rank of every player'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            fixed = leaderboard.rebuild()
+        self.stdout.write('Fixed {} ranks'.format(fixed))
@@ -0,0 +1,46 @@
+from multiprocessing import Pool
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from player import leaderboard, points
+
+
+def _recompute(args):
+    maxima, first_user_id, last_user_id = args
+    with transaction.atomic():
+        return points.recompute_range(maxima, first_user_id, last_user_id)
+
+
+def _close_connections():
+    # Every worker opens its own connection instead of sharing the one inherited from the parent
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the points of every player and their leaderboard ranks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of players loaded and updated at a time')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Number of worker processes the chunks are spread over')
+
+    def handle(self, *args, **options):
+        maxima = points.Maxima.load()
+        chunks = [(maxima, first, last) for first, last in points.chunk_bounds(options['chunk_size'])]
+
+        if options['processes'] > 1:
+            connections.close_all()
+            pool = Pool(options['processes'], initializer=_close_connections)
+            try:
+                updated = sum(pool.imap_unordered(_recompute, chunks))
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            updated = sum(_recompute(chunk) for chunk in chunks)
+
+        with transaction.atomic():
+            ranked = leaderboard.rebuild()
+        self.stdout.write('Updated the points of {} players and {} ranks'.format(updated, ranked))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def rank_profiles(apps, schema_editor):
+    from player import leaderboard
+    leaderboard.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0016_merge_20170304_1420'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='points',
+            field=models.DecimalField(db_index=True, decimal_places=10, default=0.0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='rank',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterIndexTogether(
+            name='profile',
+            index_together=set([('rank', 'id')]),
+        ),
+        migrations.RunPython(rank_profiles, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('player', '0017_profile_rank'),
+    ]
+
+    operations = [
+        # Fold duplicate rows of an item into the oldest one before making them unique
+        migrations.RunSQL(
+            "UPDATE player_inventory SET count = merged.count FROM ("
+            "  SELECT MIN(id) AS id, SUM(count) AS count FROM player_inventory "
+            "  GROUP BY user_id, item_id HAVING COUNT(*) > 1"
+            ") AS merged WHERE player_inventory.id = merged.id; "
+            "DELETE FROM player_inventory duplicate USING player_inventory kept "
+            "WHERE duplicate.user_id = kept.user_id AND duplicate.item_id = kept.item_id AND duplicate.id > kept.id",
+            migrations.RunSQL.noop,
+        ),
+        migrations.AlterUniqueTogether(
+            name='inventory',
+            unique_together=set([('user', 'item')]),
+        ),
+    ]
@@ -1,14 +1,13 @@
-from decimal import Decimal
 from random import randint
 
 from django.contrib.auth.models import User
-from django.db import models
-from django.db.models import Max
-from django.utils import timezone
+from django.db import connection, models, transaction
 from rest_framework.authtoken.models import Token
 
+from core.catalog import get_catalog
 from core.models import Item, Island, Port, Dock
 from core.models import Item, ShipStore
+from player import leaderboard
 
 
 class ProfileModelManager(models.Manager):
@@ -17,44 +16,70 @@ class ProfileModelManager(models.Manager):
             username=username
         )
 
-        Profile.objects.create(user=user)
-
-        Token.objects.create(user=user)
-
-        Inventory.objects.create_initial_inventory(user=user)
-
-        Port.objects.create_initial_ports(user=user)
-
-        Dock.objects.create_initial_docks(user=user)
-
-        ShipStore.objects.allocate_initial_ship(user=user)
+        self.create_players([user])
 
         return user
 
+    def create_players(self, users, batch_size=1000):
+        """
+        Provisions new users, creating those which haven't been saved yet, with a few statements per
+        batch of `batch_size` users
+        """
+        users = list(users)
+        for start in range(0, len(users), batch_size):
+            with transaction.atomic():
+                self._provision(users[start:start + batch_size])
+        return users
+
+    def _provision(self, users):
+        User.objects.bulk_create([user for user in users if user.pk is None])
+
+        rank = leaderboard.added(len(users), 0)
+        profiles = []
+        for user in users:
+            profile = Profile(user_id=user.id, rank=rank)
+            profile._set_random_island()
+            profiles.append(profile)
+        Profile.objects.bulk_create(profiles)
+
+        tokens = []
+        for user in users:
+            token = Token(user_id=user.id)
+            token.key = token.generate_key()
+            tokens.append(token)
+        Token.objects.bulk_create(tokens)
+
+        Inventory.objects.create_initial_inventory(users)
+
+        Port.objects.create_initial_ports(users)
+
+        Dock.objects.create_initial_docks(users, ShipStore.objects.allocate_initial_ships(users))
+
+        from player import suggestions
+        for profile in profiles:
+            suggestions.player_joined(profile.island_id, profile.user_id)
+
     def add_exp(self, profile, exp):
         profile.experience += exp
         profile.save()
+        Dock.objects.unlock_slots([profile.user_id])
 
     def del_exp(self, profile, exp):
         profile.experience -= exp
         profile.save()
 
     def update_points(self, user):
-        user = User.objects.get(username='user1')
-        points = user.profile.points
-        user_items = user.inventory.all()
-        max_items = Inventory.objects.values('item').annotate(value=Max('count'))
-        for item in user_items:
-            points += Decimal(item.count) / Decimal(max_items.get(item=item.id)['value'])
-        points += Decimal(user.profile.experience) / Decimal(
-            Profile.objects.aggregate(Max('experience'))['experience__max'])
-        user.profile.points = points
-        user.profile.save()
-
-    def update_last_seen(self, profile):
-        profile.last_seen = timezone.now()
+        from player import points
+        profile = user.profile
+        inventory = user.inventory.values_list('user_id', 'item_id', 'count')
+        value = points.compute(points.Maxima.load(), [user.id], [profile.experience], list(inventory))[0]
+        profile.points = points.to_decimal(value)
         profile.save()
 
+    def update_last_seen(self, user):
+        from player import presence
+        presence.touch(user.id)
+
     def cumulative_ship_level(self, user, level_delta):
         user.profile.cumulative_ship_level += level_delta
         user.profile.save()
@@ -67,28 +92,54 @@ class Profile(models.Model):
     island = models.ForeignKey(Island, default=None, null=True)
     fcm_token = models.CharField(max_length=255, default=None, null=True, unique=True)
     cumulative_ship_level = models.PositiveIntegerField(default=0)
-    points = models.DecimalField(default=0.0, max_digits=12, decimal_places=10)
+    points = models.DecimalField(default=0.0, max_digits=12, decimal_places=10, db_index=True)
+    # Position on the leaderboard, maintained by player.leaderboard
+    rank = models.PositiveIntegerField(default=1)
     last_seen = models.DateTimeField(auto_now_add=True)
     objects = ProfileModelManager()
 
+    class Meta:
+        index_together = (('rank', 'id'),)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Profile, cls).from_db(db, field_names, values)
+        instance._saved_points = instance.__dict__.get('points')
+        return instance
+
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
 
-        if self.island is None:
+        if self.island_id is None:
             self._set_random_island()
 
-        return super(Profile, self).save()
+        adding = self._state.adding
+        old_points = getattr(self, '_saved_points', None)
+        if not adding and old_points is None:
+            old_points = Profile.objects.filter(pk=self.pk).values_list('points', flat=True).first()
+
+        if not adding and update_fields is None:
+            # The leaderboard keeps rank up to date in the database, the loaded one may be stale
+            update_fields = [field.name for field in self._meta.concrete_fields
+                             if not field.primary_key and field.name != 'rank']
+
+        result = super(Profile, self).save(force_insert, force_update, using, update_fields)
+
+        if adding or self.points != old_points:
+            self.rank = leaderboard.moved(self.pk, None if adding else old_points, self.points)
+        self._saved_points = self.points
+        return result
 
     def _set_random_island(self):
-        # TODO: Remove this hardcoding
-        count = Island.objects.exclude(name='Pirate Island').count()
+        islands = get_catalog().habitable_islands
+        count = len(islands)
         # If not Island has been added yet, raise an error
         if count == 0:
             raise NotImplementedError
 
         random_island_id = randint(0, count - 1)
 
-        self.island = Island.objects.exclude(name='Pirate Island')[random_island_id]
+        self.island_id = islands[random_island_id].id
 
     def _set_default_avatar(self):
         pass
@@ -101,19 +152,50 @@ class Profile(models.Model):
 
 
 class InventoryModelManager(models.Manager):
-    def create_initial_inventory(self, user):
-        for item in Item.objects.all():
-            Inventory.objects.create(user=user, item=item, count=0)
+    def create_initial_inventory(self, users):
+        items = get_catalog().items
+        Inventory.objects.bulk_create([Inventory(user_id=user.id, item_id=item.id, count=0)
+                                       for user in users for item in items])
 
     def add_item(self, user, item, value):
-        inventory = Inventory.objects.get(user=user, item=item)
-        inventory.count += value
-        inventory.save()
-
-    def sub_item(self, user, item, value):
-        inventory = Inventory.objects.get(user=user, item=item)
-        inventory.count -= value
-        inventory.save()
+        self.credit(user, {getattr(item, 'pk', item): value})
+
+    def _apply(self, user, amounts, sign, condition=''):
+        amounts = sorted((item_id, amount) for item_id, amount in amounts.items() if amount)
+        if not amounts:
+            return []
+        params = []
+        for item_id, amount in amounts:
+            params.extend([item_id, amount])
+        params.append(getattr(user, 'pk', user))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE player_inventory SET count = player_inventory.count {sign} v.amount '
+                'FROM (VALUES {values}) AS v (item_id, amount) '
+                'WHERE player_inventory.user_id = %s AND player_inventory.item_id = v.item_id{condition} '
+                'RETURNING player_inventory.item_id'.format(sign=sign, values=', '.join(['(%s, %s)'] * len(amounts)),
+                                                            condition=condition),
+                params
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def credit(self, user, amounts):
+        """
+        Adds {item id: count} to the inventory of a user in a single statement
+        """
+        self._apply(user, amounts, '+')
+
+    def debit(self, user, amounts):
+        """
+        Takes {item id: count} from the inventory of a user in a single conditional statement.
+        Returns the ids of the items the user has too few of, in which case nothing is taken.
+        """
+        debited = self._apply(user, amounts, '-', ' AND player_inventory.count >= v.amount')
+        failed = [item_id for item_id in sorted(amounts) if amounts[item_id] and item_id not in debited]
+        if failed and debited:
+            # Some items were short, give back the ones which were taken
+            self._apply(user, {item_id: amounts[item_id] for item_id in debited}, '+')
+        return failed
 
 
 class Inventory(models.Model):
@@ -125,6 +207,7 @@ class Inventory(models.Model):
 
     class Meta:
         verbose_name_plural = 'Inventory'
+        unique_together = ('user', 'item')
 
     def __str__(self):
         return self.user.username + " : " + self.item.name + " : " + str(self.count)
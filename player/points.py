@@ -0,0 +1,95 @@
+"""
+Points of the players: the count of every item normalised by the largest count of that item held by
+any player, plus the experience normalised by the largest experience
+"""
+from decimal import Decimal
+
+import numpy
+from django.db import connection
+from django.db.models import Max
+
+from player.models import Inventory, Profile
+
+PLACES = Decimal(10) ** -Profile._meta.get_field('points').decimal_places
+
+
+class Maxima(object):
+    """
+    Largest count of every item and largest experience, the denominators of the points
+    """
+
+    def __init__(self, item_ids, item_counts, experience):
+        self.item_ids = numpy.asarray(item_ids, dtype=numpy.int64)
+        self.item_counts = numpy.asarray(item_counts, dtype=numpy.float64)
+        self.experience = experience
+
+    @classmethod
+    def load(cls):
+        rows = list(Inventory.objects.values_list('item_id').annotate(Max('count')).order_by('item_id'))
+        item_ids, item_counts = zip(*rows) if rows else ((), ())
+        experience = Profile.objects.aggregate(Max('experience'))['experience__max']
+        return cls(item_ids, item_counts, experience or 0)
+
+
+def compute(maxima, user_ids, experience, inventory):
+    """
+    Points of the players `user_ids` (sorted) with `experience`, given their inventory as
+    (user_id, item_id, count) rows. Items nobody holds any of add nothing.
+    """
+    user_ids = numpy.asarray(user_ids, dtype=numpy.int64)
+    points = numpy.zeros(len(user_ids), dtype=numpy.float64)
+    if maxima.experience > 0:
+        points += numpy.asarray(experience, dtype=numpy.float64) / maxima.experience
+
+    inventory = numpy.array(inventory, dtype=numpy.int64).reshape(-1, 3)
+    if len(inventory) and len(maxima.item_ids) and len(user_ids):
+        inventory_users, inventory_items, counts = inventory.T
+        item_index = numpy.searchsorted(maxima.item_ids, inventory_items).clip(max=len(maxima.item_ids) - 1)
+        user_index = numpy.searchsorted(user_ids, inventory_users).clip(max=len(user_ids) - 1)
+        denominators = maxima.item_counts[item_index]
+        held = ((maxima.item_ids[item_index] == inventory_items) & (user_ids[user_index] == inventory_users) &
+                (denominators > 0))
+        numpy.add.at(points, user_index[held], counts[held] / denominators[held])
+    return points
+
+
+def to_decimal(value):
+    return Decimal(repr(float(value))).quantize(PLACES)
+
+
+def recompute_range(maxima, first_user_id, last_user_id):
+    """
+    Recomputes and stores the points of the players with user ids in [first_user_id, last_user_id],
+    returns the number of profiles whose points changed
+    """
+    profiles = Profile.objects.filter(user_id__gte=first_user_id, user_id__lte=last_user_id)
+    rows = list(profiles.order_by('user_id').values_list('user_id', 'experience'))
+    if not rows:
+        return 0
+    user_ids, experience = zip(*rows)
+
+    inventory = list(Inventory.objects.filter(user_id__gte=first_user_id, user_id__lte=last_user_id)
+                     .values_list('user_id', 'item_id', 'count'))
+    points = compute(maxima, user_ids, experience, inventory)
+
+    params = []
+    for user_id, value in zip(user_ids, points):
+        params.extend([user_id, to_decimal(value)])
+    values = ', '.join(['(%s, %s)'] * len(user_ids))
+    with connection.cursor() as cursor:
+        cursor.execute('UPDATE player_profile SET points = v.points FROM (VALUES {}) AS v (user_id, points) '
+                       'WHERE player_profile.user_id = v.user_id '
+                       'AND player_profile.points <> v.points'.format(values), params)
+        return cursor.rowcount
+
+
+def chunk_bounds(chunk_size):
+    """
+    (first, last) user ids of consecutive chunks of `chunk_size` profiles
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT MIN(user_id), MAX(user_id) FROM '
+                       '(SELECT user_id, (ROW_NUMBER() OVER (ORDER BY user_id) - 1) / %s AS chunk '
+                       'FROM player_profile) AS numbered GROUP BY chunk ORDER BY chunk',
+                       [chunk_size])
+        return cursor.fetchall()
@@ -0,0 +1,107 @@
+"""
+Buffered Profile.last_seen updates
+
+Visits are kept per worker and written with one UPDATE per batch by a background thread every
+LAST_SEEN_FLUSH_INTERVAL seconds, and once more when the worker exits, so the stored last_seen lags by at
+most about that long. The writes run outside the requests, keeping the row locks out of read requests.
+"""
+import atexit
+import logging
+import time
+from threading import Lock, Thread
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from core.models import values_list_sql
+
+BATCH_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+_pending = {}
+_flusher = None
+_lock = Lock()
+
+
+def _interval():
+    return getattr(settings, 'LAST_SEEN_FLUSH_INTERVAL', 60)
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(_interval())
+        try:
+            flush()
+        except Exception:
+            # The visits are back in the buffer, the next round retries them
+            logger.exception('Could not write the buffered last_seen updates')
+        finally:
+            # The thread outlives any request, so it doesn't keep its connection around
+            connection.close()
+
+
+def _start_flusher():
+    """
+    Starts the thread writing the buffer of this worker, at the first visit so forked workers get their own
+    """
+    global _flusher
+    with _lock:
+        if _flusher is not None:
+            return
+        _flusher = Thread(target=_flush_periodically, name='last-seen-flush', daemon=True)
+    _flusher.start()
+    atexit.register(flush)
+
+
+def touch(user_id, now=None):
+    """
+    Records a visit of the user, written by the next flush
+    """
+    if now is None:
+        now = timezone.now()
+    with _lock:
+        _pending[user_id] = now
+    if _flusher is None:
+        _start_flusher()
+
+
+def _restore(seen):
+    """
+    Puts visits which couldn't be written back into the buffer, unless newer ones came in since
+    """
+    with _lock:
+        for user_id, seen_at in seen:
+            if user_id not in _pending or _pending[user_id] < seen_at:
+                _pending[user_id] = seen_at
+
+
+def flush():
+    """
+    Writes the buffered visits, returns how many profiles were updated.
+    Visits which fail to be written are kept for the next flush.
+    """
+    with _lock:
+        seen = list(_pending.items())
+        _pending.clear()
+    if not seen:
+        return 0
+
+    updated = 0
+    written = 0
+    try:
+        with connection.cursor() as cursor:
+            for start in range(0, len(seen), BATCH_SIZE):
+                values, params = values_list_sql(seen[start:start + BATCH_SIZE])
+                cursor.execute(
+                    "UPDATE player_profile profile SET last_seen = seen.last_seen "
+                    "FROM (" + values + ") AS seen (user_id, last_seen) WHERE profile.user_id = seen.user_id",
+                    params
+                )
+                updated += cursor.rowcount
+                written = start + BATCH_SIZE
+    except Exception:
+        _restore(seen[written:])
+        raise
+    return updated
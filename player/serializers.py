@@ -69,6 +69,13 @@ class UserProfileSerializer(serializers.ModelSerializer):
                   'inventory', 'gravatar')
         read_only_fields = ('username', 'email', 'experience')
 
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # The user may be a cached copy, so only the fields sent are written
+        instance.save(update_fields=list(validated_data))
+        return instance
+
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
     email = serializers.EmailField(required=True)
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from rest_framework.authtoken.models import Token
+
+from player import authentication, leaderboard, suggestions
+from player.models import Profile
+
+
+def remove_from_leaderboard(sender, instance, **kwargs):
+    leaderboard.removed(instance.points)
+
+
+def add_to_suggestions(sender, instance, created, **kwargs):
+    if created:
+        suggestions.player_joined(instance.island_id, instance.user_id)
+
+
+def forget_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # Covers password resets and deactivation, which save the user.
+    # Logins only touch last_login, which doesn't change who the token authenticates.
+    if not created and set(update_fields or ()) != {'last_login'}:
+        authentication.forget_user(instance.id)
+
+
+def forget_token(sender, instance, **kwargs):
+    authentication.forget(instance.key)
+
+
+post_save.connect(add_to_suggestions, sender=Profile, dispatch_uid='suggestions-save-profile')
+post_delete.connect(remove_from_leaderboard, sender=Profile, dispatch_uid='leaderboard-delete-profile')
+post_save.connect(forget_user_tokens, sender=User, dispatch_uid='authentication-save-user')
+post_delete.connect(forget_token, sender=Token, dispatch_uid='authentication-delete-token')
@@ -0,0 +1,105 @@
+"""
+Raid suggestions: random players of an island who have an idle non parking port
+
+Every worker keeps the user ids of the players of each island who had an idle non parking port when
+it was loaded, reloaded every INDEX_TTL seconds and extended as players join, so picking candidates
+costs no query. The idle ports of the sampled candidates are then counted in one query, and more
+candidates are drawn only when players have been raided since the index was loaded.
+"""
+import random
+import time
+from array import array
+from threading import Lock
+
+from django.db import connection
+
+from core.catalog import get_catalog
+
+# Seconds a worker trusts its list of the players of an island
+INDEX_TTL = 60
+SUGGESTIONS = 5
+# Candidates sampled per suggestion, as some of them have no idle port to dock at
+OVERSAMPLING = 4
+
+_islands = {}
+_lock = Lock()
+
+
+def island_user_ids(island_id):
+    """
+    User ids of the players of an island with an idle non parking port, as of the last load.
+    May include players who have since left the island or been docked at.
+    """
+    entry = _islands.get(island_id)
+    if entry is None or time.time() - entry[0] >= INDEX_TTL:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT profile.user_id FROM player_profile profile WHERE profile.island_id = %s AND EXISTS ("
+                "  SELECT 1 FROM core_port port WHERE port.user_id = profile.user_id AND port.log_id IS NULL "
+                "  AND port.type_id = %s"
+                ")",
+                [island_id, get_catalog().non_parking_port_type.id]
+            )
+            entry = (time.time(), array('l', (row[0] for row in cursor.fetchall())))
+        with _lock:
+            _islands[island_id] = entry
+    return entry[1]
+
+
+def player_joined(island_id, user_id):
+    entry = _islands.get(island_id)
+    if entry is not None:
+        with _lock:
+            entry[1].append(user_id)
+
+
+def _draw(size, drawn, count):
+    """
+    Up to `count` random indices below `size` which are not in `drawn`, adding them to it
+    """
+    indices = []
+    while len(indices) < count and len(drawn) < size:
+        index = random.randrange(size)
+        if index not in drawn:
+            drawn.add(index)
+            indices.append(index)
+    return indices
+
+
+def _eligible(candidates, island_id):
+    catalog = get_catalog()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT player.id, player.username, player.email, "
+            "  COUNT(*) FILTER (WHERE port.type_id = %s), COUNT(*) FILTER (WHERE port.type_id = %s) "
+            "FROM auth_user player "
+            "JOIN player_profile profile ON profile.user_id = player.id "
+            "JOIN core_port port ON port.user_id = player.id AND port.log_id IS NULL "
+            "WHERE player.id = ANY(%s) AND profile.island_id = %s "
+            "GROUP BY player.id "
+            "HAVING COUNT(*) FILTER (WHERE port.type_id = %s) > 0",
+            [catalog.parking_port_type.id, catalog.non_parking_port_type.id, candidates, island_id,
+             catalog.non_parking_port_type.id]
+        )
+        return cursor.fetchall()
+
+
+def suggest(island_id, exclude_user_id, count=SUGGESTIONS):
+    """
+    Up to `count` random players of an island with an idle non parking port, as
+    (user id, username, email, idle parking ports, idle non parking ports) rows.
+    Fewer are returned only when the island has no more of them.
+    """
+    user_ids = island_user_ids(island_id)
+    drawn = set()
+    rows = []
+    batch = count * OVERSAMPLING
+    while len(rows) < count and len(drawn) < len(user_ids):
+        candidates = list({user_ids[index] for index in _draw(len(user_ids), drawn, batch)} - {exclude_user_id})
+        if candidates:
+            found = _eligible(candidates, island_id)
+            random.shuffle(found)
+            rows.extend(found[:count - len(rows)])
+        # Each round draws twice as many, so an island of stale entries takes few queries to exhaust
+        batch *= 2
+    return rows
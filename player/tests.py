@@ -1,12 +1,20 @@
+from decimal import Decimal
+from unittest import mock
+
 from django.contrib.auth.models import User
 from django.core.management import call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from rest_framework import status
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
-from core.models import Island
-from player.models import Profile
+from core.catalog import get_catalog
+from core.models import Dock, Island, Item, Port, Ship, Slot
+from player import authentication, presence, suggestions
+from player.models import Inventory, Profile
 
 
 def setUpModule():
@@ -163,12 +171,157 @@ class UserViewTests(APITestCase):
         self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
 
         response = self.client.get(self.url)
+        # Buffered visits are written after the request commits, which tests never do
+        presence.flush()
 
         profile.refresh_from_db()
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(profile.last_seen.minute, timezone.now().minute)
 
 
+class PresenceTests(APITestCase):
+    def test_flushes_in_one_update(self):
+        users = [User.objects.create_user(username='user_{}'.format(index)) for index in range(3)]
+        for user in users:
+            Profile.objects.create_player(username=user.username)
+        seen = timezone.now() + timezone.timedelta(minutes=5)
+        for user in users:
+            presence.touch(user.id, now=seen)
+            presence.touch(user.id, now=seen)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(presence.flush(), 3)
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(Profile.objects.filter(user__in=users, last_seen=seen).count(), 3)
+
+    def test_failed_flush_keeps_visits(self):
+        seen = timezone.now()
+        presence.touch(1, now=seen)
+        with mock.patch.object(presence, 'values_list_sql', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                presence.flush()
+        self.assertEqual(presence._pending[1], seen)
+
+        # A newer visit recorded in the meantime wins over the restored one
+        later = seen + timezone.timedelta(minutes=1)
+        presence._pending.clear()
+        presence.touch(1, now=later)
+        presence._restore([(1, seen)])
+        self.assertEqual(presence._pending[1], later)
+        presence._pending.clear()
+
+    def test_flushed_without_requests(self):
+        user = User.objects.create_user(username='some_username')
+        Profile.objects.create_player(username='some_username')
+        presence.touch(user.id)
+
+        # A background thread writes the buffer, no later request is needed
+        self.assertTrue(presence._flusher.is_alive())
+        self.assertTrue(presence._flusher.daemon)
+        with CaptureQueriesContext(connection) as queries:
+            presence.flush()
+            self.assertEqual(presence.flush(), 0)
+        self.assertLessEqual(len(queries), 1)
+
+
+class SnapshotTests(APITestCase):
+    url = reverse('player:snapshot')
+
+    def test_matches_separate_calls(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user'], self.client.get(reverse('player:user')).data)
+        self.assertEqual(response.data['docks'], self.client.get(reverse('docks')).data)
+        self.assertEqual(response.data['ships'], self.client.get(reverse('player:ships')).data)
+        self.assertEqual(response.data['ports'], self.client.get(reverse('ports')).data)
+
+    def test_leaves_out_inactive_ships(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        Ship.objects.create(ship_store_id=get_catalog().raft.id, user=user, is_active=False)
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data['ships']), 1)
+        self.assertEqual(response.data['ships'], self.client.get(reverse('player:ships')).data)
+
+
+class CachedTokenAuthenticationTests(APITestCase):
+    url = reverse('player:user')
+
+    def test_cached_until_user_saved(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in queries if 'authtoken_token' in query['sql']])
+
+        user.is_active = False
+        user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_forgets_deleted_token(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        self.client.get(self.url)
+
+        user.auth_token.delete()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cached_user_saves_only_changes(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        self.client.get(self.url)
+        # Changed behind the cache's back, the cached copy still has the old values
+        User.objects.filter(pk=user.pk).update(is_active=False, email='new_email@gmail.com')
+
+        response = self.client.post(reverse('player:reset-password'), {'password': 'a_new_password'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertFalse(user.is_active)
+        self.assertEqual(user.email, 'new_email@gmail.com')
+
+    def test_caches_profile_id(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        backend = authentication.CachedTokenAuthentication()
+        backend.authenticate_credentials(user.auth_token.key)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached, _ = backend.authenticate_credentials(user.auth_token.key)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cached.profile_id, user.profile.id)
+
+    def test_login_keeps_cached_token(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+
+        with CaptureQueriesContext(connection) as queries:
+            user.last_login = timezone.now()
+            user.save(update_fields=['last_login'])
+        self.assertFalse([query for query in queries if 'authtoken_token' in query['sql']])
+
+
 class FCMTokenViewTests(APITestCase):
     url = reverse('player:fcm')
 
@@ -270,6 +423,66 @@ class GetSuggestionTests(APITestCase):
         self.assertEqual(response.data[0]['non_parking'], 3)
         self.assertEqual(response.data[0]['name'], 'some_username2')
 
+    def test_constant_queries(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        island = Island.objects.filter(habitable=True).first()
+
+        def add_players(usernames):
+            for username in usernames:
+                User.objects.create_user(username=username, password='some_password')
+                Profile.objects.create_player(username=username)
+            for profile in Profile.objects.filter(user__username__in=usernames):
+                profile.island = island
+                profile.save()
+                suggestions.player_joined(island.id, profile.user_id)
+
+        add_players(['user_0'])
+        self.client.post(self.url, {'island_id': island.id})
+        with CaptureQueriesContext(connection) as few_players:
+            response = self.client.post(self.url, {'island_id': island.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        add_players(['user_{}'.format(index) for index in range(1, 12)])
+        with CaptureQueriesContext(connection) as many_players:
+            response = self.client.post(self.url, {'island_id': island.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(len(many_players), len(few_players))
+        self.assertLessEqual(len(response.data), 5)
+        for suggestion in response.data:
+            self.assertNotEqual(suggestion['user_id'], user.id)
+            self.assertEqual(suggestion['non_parking'], 3)
+
+    def test_mostly_ineligible_players(self):
+        user = User.objects.create_user(username='some_username', password='some_password',
+                                        email='some_email@gmail.com')
+        Profile.objects.create_player(username='some_username')
+        self.client.credentials(HTTP_AUTHORIZATION='Token {}'.format(user.auth_token.key))
+        island = Island.objects.filter(habitable=True).first()
+
+        usernames = ['user_{}'.format(index) for index in range(30)]
+        for username in usernames:
+            User.objects.create_user(username=username, password='some_password')
+            Profile.objects.create_player(username=username)
+        Profile.objects.filter(user__username__in=usernames).update(island=island)
+        suggestions._islands.pop(island.id, None)
+        # Loaded while every player still has idle ports, so the index goes stale
+        self.assertEqual(len(suggestions.island_user_ids(island.id)), 30)
+        Port.objects.filter(user__username__in=usernames[2:], type=get_catalog().non_parking_port_type).delete()
+        eligible = set(User.objects.filter(username__in=usernames[:2]).values_list('id', flat=True))
+
+        for count in (1, 5):
+            rows = suggestions.suggest(island.id, user.id, count)
+            self.assertEqual(len(rows), min(count, 2))
+            self.assertTrue({row[0] for row in rows} <= eligible)
+
+        # A reloaded index leaves the ineligible players out
+        suggestions._islands.pop(island.id, None)
+        self.assertEqual(set(suggestions.island_user_ids(island.id)), eligible)
+
 
 class EmailSearchTest(APITestCase):
     url = None
@@ -305,3 +518,126 @@ class UsernameSearchTest(APITestCase):
         self.assertEqual(response.data['email'], user.email)
         self.assertEqual(response.data['first_name'], "")
         self.assertEqual(response.data['last_name'], "")
+
+
+class LeaderBoardTests(APITestCase):
+    url = reverse('player:leaderboard')
+
+    def _ranks(self):
+        return dict(Profile.objects.values_list('user__username', 'rank'))
+
+    def _expected_ranks(self):
+        ranked = Profile.objects.raw('SELECT id, RANK() OVER (ORDER BY points DESC) AS expected FROM player_profile')
+        return {profile.user.username: profile.expected for profile in ranked}
+
+    def test_ranks_follow_points(self):
+        for username in ('user_a', 'user_b', 'user_c', 'user_d'):
+            User.objects.create_user(username=username, password='some_password')
+            Profile.objects.create_player(username=username)
+
+        for username, points in (('user_a', 2), ('user_b', 5), ('user_c', 2), ('user_b', 1), ('user_d', 3)):
+            profile = Profile.objects.get(user__username=username)
+            profile.points = points
+            profile.save()
+            self.assertEqual(self._ranks(), self._expected_ranks())
+
+        User.objects.get(username='user_d').delete()
+        self.assertEqual(self._ranks(), self._expected_ranks())
+
+    def test_other_saves_keep_ranks(self):
+        for username in ('user_a', 'user_b'):
+            User.objects.create_user(username=username, password='some_password')
+            Profile.objects.create_player(username=username)
+        stale = Profile.objects.get(user__username='user_a')
+
+        # Moves user_a down after `stale` was loaded
+        profile = Profile.objects.get(user__username='user_b')
+        profile.points = 5
+        profile.save()
+
+        stale.fcm_token = 'some_token'
+        stale.save()
+        self.assertEqual(self._ranks(), self._expected_ranks())
+
+    def test_pages_by_rank(self):
+        for index in range(30):
+            username = 'user_{}'.format(index)
+            User.objects.create_user(username=username, password='some_password')
+            Profile.objects.create_player(username=username)
+            profile = Profile.objects.get(user__username=username)
+            profile.points = index
+            profile.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 25)
+        self.assertEqual(response.data['results'][0]['username'], 'user_29')
+        self.assertEqual(response.data['results'][0]['rank'], 1)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['rank'] for row in response.data['results']], [26, 27, 28, 29, 30])
+
+
+class RecomputePointsTests(APITestCase):
+    def test_points_normalised_by_maxima(self):
+        for username in ('user_a', 'user_b'):
+            User.objects.create_user(username=username, password='some_password')
+            Profile.objects.create_player(username=username)
+        user_a = User.objects.get(username='user_a')
+        user_b = User.objects.get(username='user_b')
+        gold = Item.objects.get(name='Gold')
+        Inventory.objects.filter(user=user_a, item=gold).update(count=10)
+        Inventory.objects.filter(user=user_b, item=gold).update(count=40)
+        Profile.objects.filter(user=user_b).update(experience=20)
+
+        call_command('recompute_points', chunk_size=1)
+
+        profile_a = Profile.objects.get(user=user_a)
+        profile_b = Profile.objects.get(user=user_b)
+        self.assertEqual(profile_a.points, Decimal('0.75'))
+        self.assertEqual(profile_b.points, Decimal('2'))
+        self.assertEqual((profile_a.rank, profile_b.rank), (2, 1))
+
+        Profile.objects.update_points(user_a)
+        self.assertEqual(Profile.objects.get(user=user_a).points, Decimal('0.75'))
+
+
+class InventoryTests(APITestCase):
+    def test_debit_all_or_nothing(self):
+        user = User.objects.create_user(username='some_username', password='some_password')
+        Profile.objects.create_player(username='some_username')
+        coconut = Item.objects.get(name='Coconut')
+        timber = Item.objects.get(name='Timber')
+        Inventory.objects.credit(user, {coconut.id: 5, timber.id: 1})
+
+        self.assertEqual(Inventory.objects.debit(user, {coconut.id: 3, timber.id: 2}), [timber.id])
+        self.assertEqual(user.inventory.get(item=coconut).count, 5)
+        self.assertEqual(user.inventory.get(item=timber).count, 1)
+
+        self.assertEqual(Inventory.objects.debit(user, {coconut.id: 3, timber.id: 1}), [])
+        self.assertEqual(user.inventory.get(item=coconut).count, 2)
+        self.assertEqual(user.inventory.get(item=timber).count, 0)
+
+
+class CreatePlayersTests(APITestCase):
+    def _provision(self, usernames):
+        users = [User(username=username, email=username + '@gmail.com') for username in usernames]
+        get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            Profile.objects.create_players(users)
+        return users, len(queries)
+
+    def test_batch_provisioning(self):
+        _, one_player = self._provision(['user_0'])
+        users, many_players = self._provision(['user_{}'.format(index) for index in range(1, 6)])
+        self.assertEqual(many_players, one_player)
+
+        for user in users:
+            self.assertEqual(Profile.objects.get(user=user).rank, 1)
+            self.assertTrue(Token.objects.filter(user=user).exists())
+            self.assertEqual(Inventory.objects.filter(user=user, count=0).count(), Item.objects.count())
+            self.assertEqual(Port.objects.filter(user=user).count(), 5)
+            self.assertEqual(Dock.objects.filter(user=user).count(), Slot.objects.count())
+            dock = Dock.objects.get(user=user, status='unlocked')
+            self.assertEqual(dock.ship.user, user)
+            self.assertEqual(dock.slot, Slot.objects.order_by('id').first())
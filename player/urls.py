@@ -2,7 +2,7 @@ from django.conf.urls import url
 
 from core.views import ShipsListView
 from .views import UserRegistrationView, UserAuthenticationView, UserView, FCMTokenView, UserPasswordUpdateView, \
-    SuggestionListView, UsernameSearchView, EmailSearchView, LeaderBoardView
+    SuggestionListView, UsernameSearchView, EmailSearchView, LeaderBoardView, SnapshotView
 from .views import exchange_token
 
 app_name = 'player'
@@ -19,5 +19,6 @@ urlpatterns = [
     url(r'^ships/$', ShipsListView.as_view(), name='ships'),
     url(r'^get-suggestions/$', SuggestionListView.as_view(), name='suggestions'),
     url(r'^leaderboard/$', LeaderBoardView.as_view(), name='leaderboard'),
+    url(r'^snapshot/$', SnapshotView.as_view(), name='snapshot'),
     url(r'', UserView.as_view(), name='user'),
 ]
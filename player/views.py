@@ -1,24 +1,23 @@
-from random import randint
-
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from requests.exceptions import HTTPError
 from rest_framework import generics
 from rest_framework import status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from social_django.utils import psa
 
-from core.models import Port, DockChart
-from core.serializers import SuggestionListSerializer
+from core.models import Dock, Port, Ship
+from core.serializers import SuggestionListSerializer, DocksListSerializer, PortsListSerializer, ShipsListSerializer, \
+    gravatar_url
+from player import suggestions
+from player.authentication import CachedTokenAuthentication
 from player.models import Profile
 from player.serializers import SocialSerializer, LeaderboardSerializer
-import hashlib
-import urllib.parse
 
 @api_view(http_method_names=['POST'])
 @permission_classes([AllowAny])
@@ -98,13 +97,21 @@ from player.serializers import UserRegistrationSerializer, UserAuthenticationSer
     UserPasswordSerializer, UserProfileSerializer, UserSearchSerializer
 
 
+class LeaderBoardPagination(CursorPagination):
+    """
+    Pages through the leaderboard by rank, using the (rank, id) index
+    """
+    page_size = 25
+    ordering = ('rank', 'id')
+
+
 class LeaderBoardView(generics.ListAPIView):
     """
     Shows the leaderboard
     """
-    queryset = Profile.objects.raw("SELECT id, RANK() over (ORDER BY points DESC ) as rank  FROM player_profile ;")
+    queryset = Profile.objects.select_related('user')
     serializer_class = LeaderboardSerializer
-    paginate_by = 25
+    pagination_class = LeaderBoardPagination
 
 
 class UserRegistrationView(APIView):
@@ -142,16 +149,14 @@ class UserView(APIView):
     Get all user details
     """
 
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = UserProfileSerializer
 
     def get(self, request, *args, **kwargs):
 
-        profile = request.user.profile
-        Profile.objects.update_last_seen(profile)
+        Profile.objects.update_last_seen(request.user)
 
-        DockChart.objects.undock_timedout(request.user.id)
         serializer = self.serializer_class(request.user)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -163,18 +168,47 @@ class UserView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SnapshotView(APIView):
+    """
+    Get the user details, docks, ships and ports shown on the home screen in one call
+    """
+
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        user = User.objects.select_related('profile__island').prefetch_related('inventory__item').get(
+            pk=request.user.id
+        )
+        Profile.objects.update_last_seen(user)
+
+        ships = list(Ship.objects.listing(user.id))
+        docks = Dock.objects.listing_with_ships(user.id, ships)
+        ports = Port.objects.listing(user.id)
+
+        return Response({
+            'user': UserProfileSerializer(user).data,
+            'docks': DocksListSerializer(docks, many=True).data,
+            'ships': ShipsListSerializer(ships, many=True).data,
+            'ports': PortsListSerializer(ports, many=True).data,
+        }, status=status.HTTP_200_OK)
+
+
 class FCMTokenView(APIView):
     """
     Register and update fcm token
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = UserFcmSerializer
 
     def post(self, request):
-        serializer = self.serializer_class(request.user.profile, data=request.data, partial=True)
+        # Only the id is needed to check the token is unique and to store it, which the authentication caches
+        profile = Profile(pk=request.user.profile_id, user_id=request.user.id)
+        serializer = self.serializer_class(profile, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.update(self.request.user.profile, serializer.validated_data)
+            if serializer.validated_data:
+                Profile.objects.filter(pk=profile.pk).update(**serializer.validated_data)
             return Response(status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -183,7 +217,7 @@ class UserPasswordUpdateView(APIView):
     """
     Update user's password
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
     serializer_class = UserPasswordSerializer
 
@@ -192,7 +226,8 @@ class UserPasswordUpdateView(APIView):
 
         if serializer.is_valid():
             request.user.set_password(serializer.validated_data['password'])
-            request.user.save()
+            # The user may be a cached copy, don't write back its other fields
+            request.user.save(update_fields=['password'])
             return Response(status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -201,16 +236,16 @@ class SuggestionListView(APIView):
     """
     Get suggestions
     """
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     serializer_class = SuggestionListSerializer
 
-    def response_format(self, result, user, parking_ports, non_parking_ports, gravatar):
+    def response_format(self, result, user_id, username, email, parking_ports, non_parking_ports):
         result.append({
-            'name': user.username,
-            'gravatar': gravatar,
-            'user_id': user.id,
+            'name': username,
+            'gravatar': gravatar_url(email),
+            'user_id': user_id,
             'parking': parking_ports,
             'non_parking': non_parking_ports
         })
@@ -218,39 +253,9 @@ class SuggestionListView(APIView):
     def post(self, request):
         serializer = self.serializer_class(data=request.data, context={'request': request})
         if serializer.is_valid():
-            data = serializer.validated_data['users']
-
-            # initialize
             response = []
-            count = data.count()
-            while len(response) < min(5, count) and not len(data) == 0:
-
-                random_index = randint(0, data.count() - 1)
-                user = data[random_index]
-                DockChart.objects.undock_timedout(user.id)
-
-                # remove already selected user from qureyset
-                data = data.exclude(id=user.id)
-
-                no_of_parking_ports = 0
-                no_of_non_parking_ports = 0
-
-                parking_ports = Port.objects.get_parking_ports(user)
-                for port in parking_ports:
-                    if port.is_idle():
-                        no_of_parking_ports += 1
-
-                non_parking_ports = Port.objects.get_non_parking_ports(user)
-                for port in non_parking_ports:
-                    if port.is_idle():
-                        no_of_non_parking_ports += 1
-                gravatar = "https://www.gravatar.com/avatar/%s?%s" % (
-                    hashlib.md5(user.email.lower().encode('utf-8')).hexdigest(),
-                    urllib.parse.urlencode({'s': str(40), 'd': 'identicon'})
-                )
-
-                if not (no_of_non_parking_ports == 0 or non_parking_ports == 0):
-                    self.response_format(response, user, no_of_parking_ports, no_of_non_parking_ports, gravatar)
+            for row in suggestions.suggest(serializer.validated_data['island_id'], request.user.id):
+                self.response_format(response, *row)
             return Response(response, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -260,7 +265,7 @@ class UsernameSearchView(APIView):
     Check whether user exists using username and give some details
     """
     serializer_class = UserSearchSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get(self, request, username, *args, **kwargs):
@@ -275,7 +280,7 @@ class EmailSearchView(APIView):
     Check whether user exists using email and give some details
     """
     serializer_class = UserSearchSerializer
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get(self, request, email, *args, **kwargs):